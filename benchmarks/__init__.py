@@ -0,0 +1,4 @@
+"""
+Package: benchmarks
+Performance measurements for the shopcarts service, run against DATABASE_URI
+"""
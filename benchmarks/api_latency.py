@@ -0,0 +1,338 @@
+"""
+API latency benchmark
+
+Sends requests to every route of service/routes.py, first through the Flask
+test client (the app alone) and then to gunicorn (the app behind a real WSGI
+server), at each size of the tables. It prints the p50, p95 and p99 latency,
+the throughput and the SQL statements per request of every route, read from
+the /metrics of the service.
+
+The results are saved as JSON with --output. Given the results of an earlier
+run with --baseline, it flags every route whose p95 grew by more than
+--tolerance, or that sends more statements, and exits with 1 if there is any.
+
+WARNING: this drops and recreates the tables in DATABASE_URI.
+
+Run it with:
+    python -m benchmarks.api_latency --sizes 1000 10000 100000 1000000 --output results.json
+    python -m benchmarks.api_latency --sizes 1000 10000 --baseline results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+from benchmarks.filter_latency import ITEMS_PER_SHOPCART, load
+from service import app
+from service.models import Shopcart, cache
+from tests.factories import ItemFactory, ShopcartFactory
+
+MODES = ("client", "server")
+
+# routes whose requests are too slow to repeat on large tables, by the largest size they run at
+MAX_SIZE = {"export": 10000}
+
+
+class Dataset:
+    """Picks the shopcarts and items of the requests in the loaded tables
+
+    Requests that read or add to a shopcart use the lower half of the ids. The
+    ones that remove items or shopcarts each consume one of the upper half, so
+    the data read by the others does not disappear during the run.
+    """
+
+    def __init__(self, size, customers):
+        self.size = size
+        self.customers = customers
+        self._lock = threading.Lock()
+        self._doomed = iter(range(size, size // 2, -1))
+        self._new_item_ids = iter(range(size * ITEMS_PER_SHOPCART + 1, sys.maxsize))
+
+    def shopcart(self):
+        """Returns the id of a shopcart that is kept"""
+        return random.randint(1, max(1, self.size // 2))
+
+    def doomed_shopcart(self):
+        """Returns the id of a shopcart that is not used by any other request"""
+        with self._lock:
+            return next(self._doomed)
+
+    @staticmethod
+    def items_of(shopcart_id):
+        """Returns the ids of the items loaded in a shopcart"""
+        first = (shopcart_id - 1) * ITEMS_PER_SHOPCART + 1
+        return list(range(first, first + ITEMS_PER_SHOPCART))
+
+    def new_item(self, shopcart_id):
+        """Returns the JSON of an item that is in no shopcart yet"""
+        with self._lock:
+            item_id = next(self._new_item_ids)
+        return ItemFactory(id=item_id, shopcart_id=shopcart_id).serialize()
+
+
+######################################################################
+# The requests of every route: name -> function of a Dataset returning
+# the method, the URL and the keyword arguments of the request
+######################################################################
+def _update_shopcart(data):
+    shopcart_id = data.shopcart()
+    return "PUT", f"/api/shopcarts/{shopcart_id}", {"json": {"id": shopcart_id, "customer_id": 1, "items": []}}
+
+
+def _add_item(data):
+    shopcart_id = data.shopcart()
+    return "POST", f"/api/shopcarts/{shopcart_id}/items", {"json": data.new_item(shopcart_id)}
+
+
+def _read_item(data):
+    shopcart_id = data.shopcart()
+    return "GET", f"/api/shopcarts/{shopcart_id}/items/{random.choice(data.items_of(shopcart_id))}", {}
+
+
+def _update_item(data):
+    shopcart_id = data.shopcart()
+    item_id = random.choice(data.items_of(shopcart_id))
+    return "PUT", f"/api/shopcarts/{shopcart_id}/items/{item_id}", {"json": {"quantity": random.randint(1, 5)}}
+
+
+def _delete_item(data):
+    shopcart_id = data.doomed_shopcart()
+    return "DELETE", f"/api/shopcarts/{shopcart_id}/items/{data.items_of(shopcart_id)[0]}", {}
+
+
+def _checkout(data):
+    shopcart_id = data.doomed_shopcart()
+    items = [{"id": item_id} for item_id in data.items_of(shopcart_id)[1:]]
+    return "POST", f"/api/shopcarts/{shopcart_id}/checkout", {"json": {"items": items}}
+
+
+def _add_items(data):
+    shopcart_id = data.shopcart()
+    return "POST", f"/api/shopcarts/{shopcart_id}/items/batch", {"json": [data.new_item(shopcart_id) for _ in range(5)]}
+
+
+SCENARIOS = {
+    "index": lambda data: ("GET", "/", {}),
+    "health": lambda data: ("GET", "/health", {}),
+    "pool stats": lambda data: ("GET", "/stats/pool", {}),
+    "cache stats": lambda data: ("GET", "/stats/cache", {}),
+    "list": lambda data: ("GET", "/api/shopcarts", {"params": {"limit": 20}}),
+    "list by customer": lambda data: (
+        "GET", "/api/shopcarts", {"params": {"customer_id": random.randint(0, data.customers), "limit": 20}}
+    ),
+    "export": lambda data: ("GET", "/api/shopcarts/export", {}),
+    "create shopcart": lambda data: ("POST", "/api/shopcarts", {"json": ShopcartFactory(items=[]).serialize()}),
+    "read shopcart": lambda data: ("GET", f"/api/shopcarts/{data.shopcart()}", {}),
+    "update shopcart": _update_shopcart,
+    "shopcart totals": lambda data: ("GET", f"/api/shopcarts/{data.shopcart()}/totals", {}),
+    "analytics": lambda data: ("GET", "/api/analytics", {}),
+    "list items": lambda data: ("GET", f"/api/shopcarts/{data.shopcart()}/items", {}),
+    "add item": _add_item,
+    "add items": _add_items,
+    "read item": _read_item,
+    "update item": _update_item,
+    "delete item": _delete_item,
+    "checkout": _checkout,
+    "reset shopcart": lambda data: ("PUT", f"/api/shopcarts/{data.doomed_shopcart()}/reset", {}),
+    "delete shopcart": lambda data: ("DELETE", f"/api/shopcarts/{data.doomed_shopcart()}", {}),
+}
+
+
+######################################################################
+# The two ways of sending the requests
+######################################################################
+class TestClientTarget:
+    """Sends the requests to the app in this process"""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def send(self, method, url, params=None, json=None):  # pylint: disable=redefined-outer-name
+        """Returns the status code of a request"""
+        return self.client.open(url, method=method, query_string=params, json=json).status_code
+
+    def metrics(self):
+        """Returns the text of /metrics"""
+        return self.client.get("/metrics").get_data(as_text=True)
+
+    def close(self):
+        """Nothing to stop"""
+
+
+class ServerTarget:
+    """Sends the requests to the app served by gunicorn"""
+
+    def __init__(self, port, workers):
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.metrics_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        environ = dict(
+            os.environ, GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(workers),
+            PROMETHEUS_MULTIPROC_DIR=self.metrics_dir.name, GUNICORN_LOG_LEVEL="warning",
+        )
+        self.server = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "service:app"],
+            env=environ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self._local = threading.local()
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(f"{self.base_url}/health").status_code == 200:
+                    return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        self.close()
+        raise RuntimeError(f"gunicorn did not start on port {port}")
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = httpx.Client(base_url=self.base_url, timeout=60)
+        return self._local.client
+
+    def send(self, method, url, params=None, json=None):  # pylint: disable=redefined-outer-name
+        """Returns the status code of a request"""
+        return self._client().request(method, url, params=params, json=json).status_code
+
+    def metrics(self):
+        """Returns the text of /metrics, which adds up all of the workers"""
+        return httpx.get(f"{self.base_url}/metrics").text
+
+    def close(self):
+        """Stops gunicorn"""
+        self.server.terminate()
+        self.server.wait()
+        self.metrics_dir.cleanup()
+
+
+######################################################################
+# Measurements
+######################################################################
+def percentile(ordered, fraction):
+    """Returns the value at a fraction of a sorted list, by the nearest rank"""
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def statements(target):
+    """Returns the number of SQL statements sent by all of the requests so far"""
+    for family in text_string_to_metric_families(target.metrics()):
+        if family.name == "http_request_db_queries":
+            return sum(sample.value for sample in family.samples if sample.name.endswith("_sum"))
+    return 0
+
+
+def measure(target, scenario, data, requests, concurrency):
+    """Sends requests of a scenario and returns their statistics"""
+
+    def timed(_):
+        method, url, options = scenario(data)
+        start = time.perf_counter()
+        code = target.send(method, url, **options)
+        return (time.perf_counter() - start) * 1000, code
+
+    before = statements(target)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, code in results if code >= 400),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "requests_per_second": requests / elapsed,
+        "queries_per_request": (statements(target) - before) / requests,
+    }
+
+
+def run(sizes, modes, requests, concurrency, workers):
+    """Measures every route at every size and returns the results"""
+    results = []
+    print(f"{'shopcarts':>10} {'mode':>6} {'route':<17} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'req/s':>7} {'queries':>7} {'errors':>6}")
+    for size in sizes:
+        for mode in modes:
+            # every mode starts from the same tables
+            data = Dataset(size, load(size))
+            cache.clear()
+            target = TestClientTarget() if mode == "client" else ServerTarget(8093, workers)
+            try:
+                for name, scenario in SCENARIOS.items():
+                    if size > MAX_SIZE.get(name, size):
+                        continue
+                    result = measure(
+                        target, scenario, data, requests, 1 if mode == "client" else concurrency
+                    )
+                    results.append({"size": size, "mode": mode, "route": name, **result})
+                    print(f"{size:>10} {mode:>6} {name:<17} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                          f"{result['p99_ms']:>9.2f} {result['requests_per_second']:>7.0f} "
+                          f"{result['queries_per_request']:>7.1f} {result['errors']:>6}")
+            finally:
+                target.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of results against the results of a baseline run"""
+    before = {(result["size"], result["mode"], result["route"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = before.get((result["size"], result["mode"], result["route"]))
+        if old is None:
+            continue
+        label = f"{result['route']} ({result['mode']}, {result['size']} shopcarts)"
+        if result["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {old['p95_ms']:.2f} ms -> {result['p95_ms']:.2f} ms")
+        if result["queries_per_request"] > old["queries_per_request"] + 0.05:
+            regressions.append(
+                f"{label}: {old['queries_per_request']:.1f} -> {result['queries_per_request']:.1f} queries per request"
+            )
+        if result["errors"] > old["errors"]:
+            regressions.append(f"{label}: {old['errors']} -> {result['errors']} errors")
+    return regressions
+
+
+def main():
+    """Parses the command line and runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of shopcarts to measure, from 1000 to 1000000")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES),
+                        help="client: the Flask test client, server: gunicorn")
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight against gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--output", help="file to save the results in as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 growth flagged as a regression")
+    args = parser.parse_args()
+    if min(args.sizes) < 8 * args.requests:
+        parser.error("every size needs at least 8 shopcarts per request, lower --requests")
+    app.logger.setLevel(logging.WARNING)
+    Shopcart.init_db(app)
+
+    results = run(args.sizes, args.modes, args.requests, args.concurrency, args.workers)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"python": platform.python_version(), "started": time.time(), "results": results}, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
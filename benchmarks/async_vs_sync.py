@@ -0,0 +1,123 @@
+"""
+Async vs sync serving benchmark
+
+Starts the Flask app under gunicorn sync workers and the ASGI app
+(service/asgi.py) under uvicorn with the same number of worker processes,
+then drives both with the same mix of shopcart reads and item adds at a
+high number of concurrent connections and prints throughput and latency.
+
+WARNING: this drops and recreates the tables in DATABASE_URI.
+
+Run it with:
+    python -m benchmarks.async_vs_sync --concurrency 16 64 256 --duration 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+from benchmarks.filter_latency import load
+from service import app
+from service.models import Shopcart
+
+SERVERS = {
+    "sync": ["gunicorn", "--bind", "127.0.0.1:{port}", "--workers", "{workers}", "service:app"],
+    "async": ["uvicorn", "--host", "127.0.0.1", "--port", "{port}", "--workers", "{workers}", "service.asgi:app"],
+}
+
+
+def start(name, port, workers):
+    """Starts a server and waits until it answers its health check"""
+    command = [part.format(port=port, workers=workers) for part in SERVERS[name]]
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", *command], env=os.environ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"The {name} server did not start on port {port}")
+
+
+async def request(client, size, item_ids):
+    """Sends one request of the mix: 80% reads of a shopcart or a page, 20% item adds"""
+    shopcart_id = random.randint(1, size)
+    roll = random.random()
+    if roll < 0.6:
+        return await client.get(f"/api/shopcarts/{shopcart_id}")
+    if roll < 0.8:
+        return await client.get("/api/shopcarts", params={"customer_id": random.randint(0, size // 5), "limit": 20})
+    item = {"id": next(item_ids), "name": "item", "price": 9.99, "quantity": 1, "color": "red"}
+    return await client.post(f"/api/shopcarts/{shopcart_id}/items", json=item)
+
+
+async def drive(base_url, size, concurrency, duration, item_ids):
+    """Keeps concurrency requests in flight for duration seconds, returns the latencies and errors"""
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        deadline = time.monotonic() + duration
+
+        async def user():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start_time = time.perf_counter()
+                try:
+                    resp = await request(client, size, item_ids)
+                    if resp.status_code >= 500:
+                        errors += 1
+                except httpx.TransportError:
+                    errors += 1
+                latencies.append((time.perf_counter() - start_time) * 1000)
+
+        await asyncio.gather(*[user() for _ in range(concurrency)])
+    return latencies, errors
+
+
+def run(size, workers, concurrencies, duration):
+    """Prints the throughput and latencies of both servers at each concurrency"""
+    load(size)
+    # ids of the items added by the benchmark, above the ones loaded
+    item_ids = iter(range(size * 10, sys.maxsize))
+    print(f"{'server':>6} {'concurrency':>11} {'req/s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    for port, name in enumerate(SERVERS, start=8091):
+        server = start(name, port, workers)
+        try:
+            for concurrency in concurrencies:
+                latencies, errors = asyncio.run(
+                    drive(f"http://127.0.0.1:{port}", size, concurrency, duration, item_ids)
+                )
+                p50 = statistics.median(latencies)
+                p99 = statistics.quantiles(latencies, n=100)[98]
+                print(f"{name:>6} {concurrency:>11} {len(latencies) / duration:>8.0f} {p50:>9.1f} {p99:>9.1f} {errors:>7}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    """Parses the command line and runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=10000, help="number of shopcarts to load")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of each server")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 256],
+                        help="numbers of requests kept in flight")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to drive each concurrency")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.WARNING)
+    Shopcart.init_db(app)
+    run(args.size, args.workers, args.concurrency, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Filter latency benchmark
+
+Measures how the latency of the shopcart filters grows with the size of the
+tables, with and without the indexes of the schema migrations on the filtered
+columns. The rest of the schema stays at the latest version.
+
+WARNING: this drops and recreates the tables in DATABASE_URI.
+
+Run it with:
+    python -m benchmarks.filter_latency --sizes 1000 10000 100000
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+from sqlalchemy import text
+from service import app, migrations
+from service.models import Item, Shopcart, db
+
+ITEMS_PER_SHOPCART = 3
+CUSTOMERS_PER_SHOPCART = 0.2  # one customer for every 5 shopcarts
+# the migrations that index shopcart.customer_id and item.shopcart_id
+INDEX_MIGRATIONS = (1, 3)
+
+
+def load(size):
+    """Fills the tables with size shopcarts and their items in two statements"""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    customers = max(1, int(size * CUSTOMERS_PER_SHOPCART))
+    with db.engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO shopcart (customer_id) "
+                 "SELECT (random() * :customers)::int FROM generate_series(1, :size)"),
+            {"customers": customers, "size": size},
+        )
+        connection.execute(
+            text("INSERT INTO item (id, shopcart_id, name, price, quantity, color) "
+                 "SELECT n, (n - 1) / :per_shopcart + 1, 'item', 9.99, 1, 'red' "
+                 "FROM generate_series(1, :items) AS n"),
+            {"per_shopcart": ITEMS_PER_SHOPCART, "items": size * ITEMS_PER_SHOPCART},
+        )
+        connection.execute(text("ANALYZE shopcart; ANALYZE item"))
+    return customers
+
+
+def set_indexed(indexed):
+    """Applies or reverts the steps of INDEX_MIGRATIONS only, without recording a schema version"""
+    steps = [migration for migration in migrations.MIGRATIONS if migration.version in INDEX_MIGRATIONS]
+    with db.engine.begin() as connection:
+        for migration in steps if indexed else reversed(steps):
+            for statement in migration.upgrade if indexed else migration.downgrade:
+                connection.execute(text(statement))
+
+
+def measure(func, repeat):
+    """Returns the median latency of func in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.remove()
+    return statistics.median(timings)
+
+
+def run(sizes, repeat):
+    """Prints the median filter latencies for each table size and schema version"""
+    print(f"{'shopcarts':>10} {'indexed':>8} {'by customer_id (ms)':>20} {'items of a cart (ms)':>21}")
+    for size in sizes:
+        customers = load(size)
+        for indexed in (False, True):
+            set_indexed(indexed)
+            by_customer = measure(
+                lambda: Shopcart.find_by_customer_id(random.randint(0, customers)), repeat
+            )
+            items_of_cart = measure(
+                lambda: Item.query.filter(Item.shopcart_id == random.randint(1, size)).all(), repeat
+            )
+            print(f"{size:>10} {'yes' if indexed else 'no':>8} {by_customer:>20.2f} {items_of_cart:>21.2f}")
+
+
+def main():
+    """Parses the command line and runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of shopcarts to measure")
+    parser.add_argument("--repeat", type=int, default=50, help="queries per measurement")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.WARNING)
+    Shopcart.init_db(app)
+    run(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
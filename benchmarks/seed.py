@@ -0,0 +1,130 @@
+"""
+Synthetic data seeder
+
+Adds millions of shopcarts and items to DATABASE_URI with the distributions
+of production, and the values of tests/factories.py:
+
+    items per shopcart  exponential around --items-per-shopcart, so many
+                        shopcarts are empty or small and a few are large
+    customers           skewed by --customer-skew over --customers ids, the
+                        lower ids have many shopcarts and the higher ones few
+    prices              log-normal around --median-price, skewed to the
+                        cheap items with a long tail of expensive ones
+    quantities          mostly 1, following the quantities of the factories
+    last changes        spread evenly over the last --max-idle-days, so some
+                        shopcarts count as abandoned in GET /api/analytics
+
+The rows are generated in batches of --batch-size shopcarts and streamed to
+the tables with COPY, one transaction per batch, after the ids already in
+the tables. The seeded rows are added to the existing ones.
+
+Run it with:
+    python -m benchmarks.seed --shopcarts 3000000 --items-per-shopcart 3.3
+"""
+import argparse
+import io
+import logging
+import math
+import random
+import time
+from datetime import datetime, timezone
+from sqlalchemy import text
+from service import app
+from service.models import Shopcart, db
+from tests.factories import ITEM_COLORS, ITEM_NAMES, ITEM_QUANTITIES
+
+# the quantities of the factories, the smaller ones being more likely
+QUANTITY_WEIGHTS = [1 / quantity ** 2 for quantity in ITEM_QUANTITIES]
+
+
+def generate(shopcart_ids, next_item_id, options):
+    """Returns the COPY text of shopcarts with the given ids and their items, and the item count"""
+    shopcarts = []
+    items = []
+    customers, skew = options.customers, options.customer_skew
+    items_per_shopcart = options.items_per_shopcart
+    mu = math.log(options.median_price)
+    now, idle = time.time(), options.max_idle_days * 86400
+    item_id = next_item_id
+    for shopcart_id in shopcart_ids:
+        # a skew of 1 is uniform, with 2 customer k has a share of the shopcarts proportional to 1 / sqrt(k)
+        customer_id = int(customers * random.random() ** skew) + 1
+        updated_at = datetime.fromtimestamp(now - idle * random.random(), timezone.utc).isoformat()
+        shopcarts.append(f"{shopcart_id}\t{customer_id}\t{updated_at}\n")
+        count = int(random.expovariate(1 / items_per_shopcart)) if items_per_shopcart else 0
+        if not count:
+            continue
+        names = random.choices(ITEM_NAMES, k=count)
+        colors = random.choices(ITEM_COLORS, k=count)
+        quantities = random.choices(ITEM_QUANTITIES, QUANTITY_WEIGHTS, k=count)
+        for name, color, quantity in zip(names, colors, quantities):
+            price = round(random.lognormvariate(mu, 1.0), 2)
+            items.append(f"{item_id}\t{shopcart_id}\t{name}\t{price}\t{quantity}\t{color}\n")
+            item_id += 1
+    return "".join(shopcarts), "".join(items), item_id - next_item_id
+
+
+def seed(options, verbose=False):
+    """Adds the shopcarts of the options with their items and returns the numbers of shopcarts and items added"""
+    shopcarts, batch_size = options.shopcarts, options.batch_size
+    with db.engine.begin() as connection:
+        first_shopcart_id = connection.execute(text("SELECT coalesce(max(id), 0) + 1 FROM shopcart")).scalar()
+        next_item_id = connection.execute(text("SELECT coalesce(max(id), 0) + 1 FROM item")).scalar()
+    total_items = 0
+    start = time.perf_counter()
+    connection = db.engine.raw_connection()
+    try:
+        for offset in range(0, shopcarts, batch_size):
+            ids = range(first_shopcart_id + offset, first_shopcart_id + min(offset + batch_size, shopcarts))
+            shopcart_rows, item_rows, count = generate(ids, next_item_id, options)
+            cursor = connection.cursor()
+            cursor.copy_expert("COPY shopcart (id, customer_id, updated_at) FROM STDIN", io.StringIO(shopcart_rows))
+            cursor.copy_expert(
+                "COPY item (id, shopcart_id, name, price, quantity, color) FROM STDIN", io.StringIO(item_rows)
+            )
+            connection.commit()
+            next_item_id += count
+            total_items += count
+            if verbose:
+                print(f"{offset + len(ids):>10} shopcarts {total_items:>10} items {time.perf_counter() - start:>8.1f} s")
+        cursor = connection.cursor()
+        # the ids were given by the seeder, move the sequences past them
+        for table in ("shopcart", "item"):
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+        cursor.execute("ANALYZE shopcart; ANALYZE item")
+        connection.commit()
+    finally:
+        connection.close()
+    return shopcarts, total_items
+
+
+def parse_args(argv=None):
+    """Returns the options of the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shopcarts", type=int, default=1000000, help="number of shopcarts to add")
+    parser.add_argument("--customers", type=int, default=None,
+                        help="number of customer ids (default: one for every 5 shopcarts)")
+    parser.add_argument("--customer-skew", type=float, default=2.0,
+                        help="1 spreads the shopcarts evenly over the customers, higher favors the lower ids")
+    parser.add_argument("--items-per-shopcart", type=float, default=3.3, help="average number of items of a shopcart")
+    parser.add_argument("--median-price", type=float, default=20.0, help="median price of the items")
+    parser.add_argument("--max-idle-days", type=float, default=30.0,
+                        help="the shopcarts were last changed up to this many days ago")
+    parser.add_argument("--batch-size", type=int, default=50000, help="shopcarts per COPY transaction")
+    args = parser.parse_args(argv)
+    args.customers = args.customers or max(1, args.shopcarts // 5)
+    return args
+
+
+def main():
+    """Parses the command line and seeds the database"""
+    args = parse_args()
+    app.logger.setLevel(logging.WARNING)
+    Shopcart.init_db(app)
+    start = time.perf_counter()
+    shopcarts, items = seed(args, verbose=True)
+    print(f"Added {shopcarts} shopcarts and {items} items in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
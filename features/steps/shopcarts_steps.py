@@ -29,11 +29,15 @@ from compare import expect
 @given('the following shopcarts')
 def step_impl(context):
     """ Delete all Shopcarts and load new ones """
-    # List all of the shopcarts and delete them one by one
+    # List all of the shopcarts page by page and delete them one by one
     rest_endpoint = f"{context.BASE_URL}/api/shopcarts"
-    context.resp = requests.get(rest_endpoint)
-    expect(context.resp.status_code).to_equal(200)
-    existing_shopcarts = context.resp.json()
+    existing_shopcarts = []
+    next_url = rest_endpoint
+    while next_url:
+        context.resp = requests.get(next_url)
+        expect(context.resp.status_code).to_equal(200)
+        existing_shopcarts.extend(context.resp.json())
+        next_url = context.resp.links.get("next", {}).get("url")
     for shopcart in existing_shopcarts:
         context.resp = requests.delete(f"{rest_endpoint}/{shopcart['id']}")
         expect(context.resp.status_code).to_equal(204)
@@ -49,11 +53,9 @@ def step_impl(context):
         shopcarts_id.append(int(context.resp.json()["id"]))
         expect(context.resp.status_code).to_equal(201)
 
-    # load the database with new items
+    # load the database with new items, one batch request per shopcart
     for i, row in enumerate(context.table):
-        row_lst = [json.loads(row['items'].replace("'", '"'))]
-        for item in row_lst:
-            payload_item = item[0]
-            context.resp = requests.post(
-                rest_endpoint+"/"+str(shopcarts_id[i])+"/items", json=payload_item)
-            expect(context.resp.status_code).to_equal(201)
+        payload_items = json.loads(row['items'].replace("'", '"'))
+        context.resp = requests.post(
+            rest_endpoint+"/"+str(shopcarts_id[i])+"/items/batch", json=payload_items)
+        expect(context.resp.status_code).to_equal(200)
@@ -0,0 +1,139 @@
+"""
+Gunicorn configuration
+
+Loaded by gunicorn from the working directory (or with --config). Every
+setting can be overridden with an environment variable:
+
+    GUNICORN_BIND           address to listen on (default 0.0.0.0:$PORT)
+    GUNICORN_WORKER_CLASS   sync (default), gthread or gevent
+    GUNICORN_WORKERS        worker processes (default sized from the CPU and memory limits)
+    GUNICORN_THREADS        threads per gthread worker (default 4)
+    GUNICORN_CONNECTIONS    concurrent requests per gevent worker (default 100)
+    GUNICORN_PRELOAD        import the app once in the master and fork it (default true, false for gevent)
+    GUNICORN_WORKER_MEMORY_MB  memory budget of a worker used to size the default (default 48)
+    PROMETHEUS_MULTIPROC_DIR   where the workers write their metrics (default /dev/shm/shopcarts-metrics)
+
+The limits are read from CPU_LIMIT_MILLICORES and MEMORY_LIMIT_MB (set from
+the container resources in deploy/deployment.yaml), then from the cgroup of
+the container, and last from the host.
+"""
+import os
+import shutil
+import tempfile
+
+WORKER_CLASSES = ("sync", "gthread", "gevent")
+CGROUP = "/sys/fs/cgroup"
+
+
+def _read(path):
+    """Returns the stripped content of a file, None if it cannot be read"""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit(cgroup=CGROUP):
+    """Returns the number of CPUs the container may use, possibly fractional"""
+    if os.getenv("CPU_LIMIT_MILLICORES"):
+        return int(os.getenv("CPU_LIMIT_MILLICORES")) / 1000
+    cpu_max = _read(f"{cgroup}/cpu.max")  # cgroup v2: "<quota> <period>" or "max <period>"
+    if cpu_max and not cpu_max.startswith("max"):
+        quota, period = cpu_max.split()
+        return int(quota) / int(period)
+    quota = _read(f"{cgroup}/cpu/cpu.cfs_quota_us")  # cgroup v1, -1 when unlimited
+    period = _read(f"{cgroup}/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+def memory_limit_mb(cgroup=CGROUP):
+    """Returns the memory the container may use in MiB, None if it is not limited"""
+    if os.getenv("MEMORY_LIMIT_MB"):
+        return int(os.getenv("MEMORY_LIMIT_MB"))
+    limit = _read(f"{cgroup}/memory.max")  # cgroup v2, "max" when unlimited
+    if limit is None:
+        limit = _read(f"{cgroup}/memory/memory.limit_in_bytes")  # cgroup v1, huge when unlimited
+    if limit and limit.isdigit() and int(limit) < 2 ** 60:
+        return int(limit) // 2 ** 20
+    return None
+
+
+def default_workers(cpus, memory_mb, worker_memory_mb):
+    """Returns 2 workers per CPU plus one, as many as fit in the memory limit and at least one"""
+    workers = int(2 * cpus) + 1
+    if memory_mb is not None:
+        workers = min(workers, memory_mb // worker_memory_mb)
+    return max(1, workers)
+
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(f"GUNICORN_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, not {worker_class}")
+workers = int(os.getenv("GUNICORN_WORKERS") or 0) or default_workers(
+    cpu_limit(), memory_limit_mb(), int(os.getenv("GUNICORN_WORKER_MEMORY_MB", "48"))
+)
+threads = int(os.getenv("GUNICORN_THREADS", "4")) if worker_class == "gthread" else 1
+worker_connections = int(os.getenv("GUNICORN_CONNECTIONS", "100"))
+
+# gevent patches the standard library when a worker starts, after a preloaded app was imported
+preload_app = os.getenv("GUNICORN_PRELOAD", str(worker_class != "gevent")).lower() in ("true", "1", "yes")
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "20"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# recycle workers now and then so a slow leak never reaches the memory limit
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+# heartbeat files in memory, a container disk can stall them and get workers killed
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# every worker writes its metrics there and /metrics adds them up, see service/common/metrics.py;
+# it is set before the app is imported, by the master when preloading or else by the workers
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(worker_tmp_dir or tempfile.gettempdir(), "shopcarts-metrics")
+)
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Removes the metrics of a previous run of the server"""
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    """Closes any database connection the master opened while preloading the app"""
+    if server.cfg.preload_app:
+        from service import app  # pylint: disable=import-outside-toplevel
+        from service.models import db  # pylint: disable=import-outside-toplevel
+        with app.app_context():
+            db.engine.dispose()
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Makes the worker open its own database connections
+
+    With preload_app the engine was created in the master, and a connection
+    shared by several processes corrupts the protocol state. The worker drops
+    the inherited pool without closing the connections, which the master owns.
+    """
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+        patch_psycopg()
+    if server.cfg.preload_app:
+        from service import app  # pylint: disable=import-outside-toplevel
+        from service.models import db  # pylint: disable=import-outside-toplevel
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the gauges of a worker that exited, its counters and histograms are kept"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+    multiprocess.mark_process_dead(worker.pid)
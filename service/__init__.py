@@ -4,11 +4,12 @@ Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
-import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
 from .common import log_handlers
+from .common.metrics import init_metrics
+from .common.profiler import init_profiler
 
 # Create Flask application
 app = Flask(__name__)
@@ -31,19 +32,23 @@ api = Api(app,
 from service import routes         # noqa: E402, E261
 # pylint: disable=wrong-import-position
 from .common import error_handlers  # noqa: F401 E402
+from .common import cli_commands  # noqa: F401 E402
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
 
+# Prometheus metrics of the requests at /metrics
+init_metrics(app)
+# Profiles requests only when PROFILER_ENABLED is set, otherwise it adds no hook
+init_profiler(app)
+
 app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
-try:
-    routes.init_db()  # make our SQLAlchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+# The database is connected on first use, so workers boot without it.
+# The schema is created and migrated beforehand by `flask db-upgrade`
+# (the migrate job of the deployment).
+routes.init_app()
 
 app.logger.info("Service initialized!")
@@ -0,0 +1,338 @@
+"""
+ASGI entry point
+
+Serves the /api/shopcarts contract from async handlers on an asyncio
+SQLAlchemy engine (asyncpg), so that a worker keeps serving other requests
+while it waits on Postgres instead of blocking on every round trip.
+
+The models, their serialization and the statements they build are shared
+with service/models.py. The schema is still created and migrated by the
+Flask CLI (flask db-upgrade). Served here:
+
+    GET    /api/shopcarts                          (filters, pagination, ETag)
+    POST   /api/shopcarts
+    GET    /api/shopcarts/<shopcart_id>            (ETag)
+    DELETE /api/shopcarts/<shopcart_id>
+    GET    /api/shopcarts/<shopcart_id>/items      (ETag)
+    POST   /api/shopcarts/<shopcart_id>/items
+    GET    /api/shopcarts/<shopcart_id>/items/<item_id>
+
+Every other path (updates, item changes, reset, checkout, batches, export,
+totals, analytics, stats, metrics, the UI and the Swagger docs) is passed to
+the Flask app mounted as a WSGI fallback, which runs it in a thread, so this
+entry point serves the whole contract. Writes made here bump the shopcart
+versions, so the caches of Flask workers stay consistent.
+
+Run it with:
+    uvicorn service.asgi:app --host 0.0.0.0 --port 8080
+"""
+import logging
+from sqlalchemy import delete, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import selectinload, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags, quote_etag
+from service import app as flask_app, config
+from service.common import status
+from service.common.pagination import decode_cursor, encode_cursor, link_header
+from service.models import DataValidationError, Item, Shopcart
+
+logger = logging.getLogger("uvicorn.error")
+
+engine = create_async_engine(
+    make_url(config.DATABASE_URI).set(drivername="postgresql+asyncpg"),
+    pool_size=config.DB_POOL_SIZE,
+    max_overflow=config.DB_MAX_OVERFLOW,
+    pool_timeout=config.DB_POOL_TIMEOUT,
+    pool_recycle=config.DB_POOL_RECYCLE,
+    pool_pre_ping=config.DB_POOL_PRE_PING,
+)
+Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+######################################################################
+# H E L P E R S
+######################################################################
+def error(status_code, message):
+    """Raises an HTTPException that is answered like the errors of the Flask app"""
+    logger.error(message)
+    raise HTTPException(status_code, message)
+
+
+def int_arg(request, name):
+    """Returns an integer query argument, None if it was not sent"""
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return error(status.HTTP_400_BAD_REQUEST, f"{name} must be an integer.")
+
+
+async def json_body(request):
+    """Returns the JSON body of a request, which must have the application/json media type"""
+    if request.headers.get("Content-Type") != "application/json":
+        error(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Content-Type must be application/json")
+    try:
+        return await request.json()
+    except ValueError:
+        return error(status.HTTP_400_BAD_REQUEST, "The body of the request is not valid JSON.")
+
+
+def if_none_match(request, etag):
+    """Returns whether the If-None-Match header of a request holds the entity tag"""
+    return etag in parse_etags(request.headers.get("If-None-Match"))
+
+
+async def find_version(session, shopcart_id):
+    """Returns the version of a Shopcart, raises 404 if it does not exist"""
+    version = await session.scalar(select(Shopcart.version).where(Shopcart.id == shopcart_id))
+    if version is None:
+        error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' could not be found.")
+    return version
+
+
+async def find_shopcart_if_modified(request, session, shopcart_id):
+    """Returns the ETag of a Shopcart and the Shopcart, or None for it when If-None-Match holds the ETag"""
+    etag = Shopcart.etag_for(shopcart_id, await find_version(session, shopcart_id))
+    if if_none_match(request, etag):
+        return etag, None
+    shopcart = await session.get(Shopcart, shopcart_id, options=[selectinload(Shopcart.items)])
+    if shopcart is None:
+        error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' could not be found.")
+    return Shopcart.etag_for(shopcart.id, shopcart.version), shopcart
+
+
+######################################################################
+# S H O P C A R T S
+######################################################################
+def page_statement(request):
+    """Returns the page size and the query of a page of Shopcarts with the filters of the request"""
+    shopcart_id = int_arg(request, "shopcart_id")
+    customer_id = int_arg(request, "customer_id")
+    limit = int_arg(request, "limit")
+    limit = config.DEFAULT_PAGE_SIZE if limit is None else limit
+    if not 0 < limit <= config.MAX_PAGE_SIZE:
+        error(status.HTTP_400_BAD_REQUEST, f"limit must be between 1 and {config.MAX_PAGE_SIZE}.")
+    after = request.query_params.get("after")
+
+    statement = select(Shopcart)
+    if shopcart_id:
+        statement = statement.where(Shopcart.id == shopcart_id)
+    if customer_id:
+        statement = statement.where(Shopcart.customer_id == customer_id)
+    if after:
+        statement = statement.where(Shopcart.id > decode_cursor(after))
+    # fetch one extra shopcart to find out whether there is a next page
+    return limit, statement.order_by(Shopcart.id).limit(limit + 1)
+
+
+async def load_items(session, shopcarts):
+    """Loads the items of Shopcarts in one query"""
+    items = {shopcart.id: [] for shopcart in shopcarts}
+    if items:
+        statement = select(Item).where(Item.shopcart_id.in_(items)).order_by(Item.id)
+        for item in await session.scalars(statement):
+            items[item.shopcart_id].append(item)
+    for shopcart in shopcarts:
+        set_committed_value(shopcart, "items", items[shopcart.id])
+
+
+async def list_shopcarts(request):
+    """Lists one page of Shopcarts, like GET /api/shopcarts of the Flask app"""
+    limit, statement = page_statement(request)
+    async with Session() as session:
+        shopcarts = (await session.scalars(statement)).all()
+        headers = {}
+        has_next = len(shopcarts) > limit
+        if has_next:
+            shopcarts = shopcarts[:limit]
+            next_url = request.url.include_query_params(limit=limit, after=encode_cursor(shopcarts[-1].id))
+            headers["Link"] = link_header(str(next_url))
+
+        etag = Shopcart.list_etag(shopcarts, has_next)
+        headers["ETag"] = quote_etag(etag)
+        if if_none_match(request, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        # the items are loaded after the ETag check, so a 304 costs a single query
+        await load_items(session, shopcarts)
+        results = [shopcart.serialize() for shopcart in shopcarts]
+    return JSONResponse(results, status.HTTP_200_OK, headers)
+
+
+async def create_shopcart(request):
+    """Creates a Shopcart with its items"""
+    data = await json_body(request)
+    # starting from an empty collection, the items are never lazy loaded
+    shopcart = Shopcart()
+    shopcart.items = []
+    shopcart.deserialize(data)
+    async with Session() as session:
+        session.add(shopcart)
+        await session.commit()
+        message = shopcart.serialize()
+    location_url = str(request.url_for("read_shopcart", shopcart_id=shopcart.id))
+    return JSONResponse(message, status.HTTP_201_CREATED, {"Location": location_url})
+
+
+async def read_shopcart(request):
+    """Reads a Shopcart, answers 304 when If-None-Match holds its ETag"""
+    shopcart_id = request.path_params["shopcart_id"]
+    async with Session() as session:
+        etag, shopcart = await find_shopcart_if_modified(request, session, shopcart_id)
+        headers = {"ETag": quote_etag(etag)}
+        if shopcart is None:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return JSONResponse(shopcart.serialize(), status.HTTP_200_OK, headers)
+
+
+async def delete_shopcart(request):
+    """Deletes a Shopcart, its items are deleted by the cascade of the foreign key"""
+    shopcart_id = request.path_params["shopcart_id"]
+    async with Session() as session:
+        await session.execute(delete(Shopcart.__table__).where(Shopcart.id == shopcart_id))
+        await session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+# I T E M S
+######################################################################
+async def list_items(request):
+    """Lists the items of a Shopcart, answers 304 when If-None-Match holds its ETag"""
+    shopcart_id = request.path_params["shopcart_id"]
+    async with Session() as session:
+        etag, shopcart = await find_shopcart_if_modified(request, session, shopcart_id)
+        headers = {"ETag": quote_etag(etag)}
+        if shopcart is None:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return JSONResponse({"items": shopcart.serialize()["items"]}, status.HTTP_200_OK, headers)
+
+
+async def add_item(request):
+    """Adds an item to a Shopcart with the atomic upsert of Item.add_to_shopcart()"""
+    shopcart_id = request.path_params["shopcart_id"]
+    data = await json_body(request)
+    item = Item()
+    item.deserialize(dict(data, shopcart_id=shopcart_id) if isinstance(data, dict) else data)
+    missing_id = item.id is None
+    versions = None
+    if_match = parse_etags(request.headers.get("If-Match"))
+    if if_match and not if_match.star_tag:
+        versions = [Shopcart.version_from_etag(shopcart_id, etag) for etag in if_match.as_set()]
+        versions = [version for version in versions if version is not None]
+        if not versions:
+            error(status.HTTP_412_PRECONDITION_FAILED,
+                  f"If-Match does not hold an ETag of the shopcart with id '{shopcart_id}'.")
+
+    async with Session() as session:
+        results = await upsert_item(session, shopcart_id, item, versions, missing_id)
+        if results[item.id] is None and missing_id:
+            # the id drawn from the sequence is taken, move the sequence past the ids and draw again
+            await session.rollback()
+            await session.execute(Item.sync_ids_statement())
+            results = await upsert_item(session, shopcart_id, item, versions, missing_id)
+        if results[item.id] is None:
+            # nothing was written, roll back the bump of the version and find out why on this rare path only
+            await session.rollback()
+            version = await find_version(session, shopcart_id)
+            if versions is not None and version not in versions:
+                error(status.HTTP_412_PRECONDITION_FAILED,
+                      f"Shopcart with id '{shopcart_id}' was changed, its version is now {version}.")
+            error(status.HTTP_409_CONFLICT, f"Item with id '{item.id}' belongs to another shopcart.")
+        await session.commit()
+    stored_item, _ = results[item.id]
+    location_url = str(request.url_for("read_shopcart", shopcart_id=shopcart_id))
+    return JSONResponse(stored_item.serialize(), status.HTTP_201_CREATED, {"Location": location_url})
+
+
+async def upsert_item(session, shopcart_id, item, versions, draw_id):
+    """Runs the upsert of Item.add_to_shopcart() for one item, giving it the next id of the sequence with draw_id"""
+    if draw_id:
+        Item.assign_ids([item], (await session.execute(Item.next_ids_statement(1))).scalars())
+    statement, results = Item.upsert_statement(shopcart_id, [item], versions, [item.id] if draw_id else ())
+    return Item.read_upserted(await session.execute(statement), results)
+
+
+async def read_item(request):
+    """Reads an item with one lookup on the (shopcart_id, id) unique key"""
+    shopcart_id = request.path_params["shopcart_id"]
+    item_id = request.path_params["item_id"]
+    async with Session() as session:
+        item = await session.scalar(select(Item).where(Item.shopcart_id == shopcart_id, Item.id == item_id))
+        if item is None:
+            await find_version(session, shopcart_id)
+            error(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' could not be found.")
+        return JSONResponse(item.serialize(), status.HTTP_200_OK)
+
+
+async def health(_request):
+    """The health endpoint for Kubernetes"""
+    return JSONResponse({"status": "OK"}, status.HTTP_200_OK)
+
+
+######################################################################
+# E R R O R   H A N D L E R S
+######################################################################
+async def http_error(_request, exc):
+    """Answers errors with the JSON body of flask-restx"""
+    return JSONResponse({"message": exc.detail}, exc.status_code)
+
+
+async def request_validation_error(_request, exc):
+    """Handles Value Errors from bad data"""
+    logger.error(str(exc))
+    return JSONResponse(
+        {"status_code": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": str(exc)},
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def closing(wsgi_app):
+    """Wraps a WSGI app so the iterable of each response is closed once it was sent
+
+    WSGIMiddleware never calls close(), which is where Flask ends the request of a
+    streamed response and gives its database session back.
+    """
+    def wrapper(environ, start_response):
+        body = wsgi_app(environ, start_response)
+        try:
+            yield from body
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+    return wrapper
+
+
+async def dispose_engine():
+    """Closes the connections of the pool when the server stops"""
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health),
+        Route("/api/shopcarts", list_shopcarts, methods=["GET"]),
+        Route("/api/shopcarts", create_shopcart, methods=["POST"]),
+        Route("/api/shopcarts/{shopcart_id:int}", read_shopcart, methods=["GET"], name="read_shopcart"),
+        Route("/api/shopcarts/{shopcart_id:int}", delete_shopcart, methods=["DELETE"]),
+        Route("/api/shopcarts/{shopcart_id:int}/items", list_items, methods=["GET"]),
+        Route("/api/shopcarts/{shopcart_id:int}/items", add_item, methods=["POST"]),
+        Route("/api/shopcarts/{shopcart_id:int}/items/{item_id:int}", read_item, methods=["GET"]),
+        # the rest of the contract, and the methods of the paths above that are not served here
+        Mount("/", app=WSGIMiddleware(closing(flask_app))),
+    ],
+    exception_handlers={
+        HTTPException: http_error,
+        DataValidationError: request_validation_error,
+    },
+    on_shutdown=[dispose_engine],
+)
@@ -0,0 +1,164 @@
+"""
+Cache
+
+Read-through cache of serialized resources. The backend is pluggable: the
+``cache`` object is created at import and bound to a backend by init_app()
+from the CACHE_BACKEND setting, the same way ``db`` is bound to the app.
+
+A backend stores JSON-ready values under string keys and keeps counters of
+its hits, misses and evictions. LocalCache keeps them in the memory of the
+worker process; a shared backend (e.g. Redis) only needs to implement the
+same five methods.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+class CacheBackend(ABC):
+    """Interface of the cache backends"""
+
+    @abstractmethod
+    def get(self, key):
+        """Returns the value stored under key or None"""
+
+    @abstractmethod
+    def set(self, key, value):
+        """Stores a value under key"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Removes the value stored under key, if any"""
+
+    @abstractmethod
+    def clear(self):
+        """Removes all of the values"""
+
+    @abstractmethod
+    def stats(self):
+        """Returns the counters of the cache"""
+
+
+class NullCache(CacheBackend):
+    """Backend that stores nothing, every lookup is a miss"""
+
+    def __init__(self):
+        self.misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": "null", "size": 0, "hits": 0, "misses": self.misses, "evictions": 0, "expirations": 0}
+
+
+class LocalCache(CacheBackend):
+    """In-process LRU backend with a size cap and a time to live
+
+    Args:
+        max_size (int): the number of values kept, the least recently used is evicted beyond it
+        ttl (float): the seconds a value is kept after it was stored
+    """
+
+    def __init__(self, max_size=1000, ttl=10.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._values[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._values.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = (time.monotonic() + self.ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "local",
+                "size": len(self._values),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class Cache:
+    """Proxy to the backend selected by the CACHE_BACKEND setting"""
+
+    def __init__(self):
+        self.backend = NullCache()
+
+    def init_app(self, app):
+        """Creates the backend from the app configuration"""
+        name = app.config.get("CACHE_BACKEND", "local")
+        if name == "local":
+            self.backend = LocalCache(app.config.get("CACHE_MAX_SIZE", 1000), app.config.get("CACHE_TTL", 10.0))
+        elif name == "null":
+            self.backend = NullCache()
+        else:
+            raise ValueError(f"Unknown cache backend: {name}")
+
+    def get(self, key):
+        """Returns the value stored under key or None"""
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        """Stores a value under key"""
+        self.backend.set(key, value)
+
+    def delete(self, key):
+        """Removes the value stored under key, if any"""
+        self.backend.delete(key)
+
+    def clear(self):
+        """Removes all of the values"""
+        self.backend.clear()
+
+    def stats(self):
+        """Returns the counters of the backend"""
+        return self.backend.stats()
@@ -0,0 +1,43 @@
+"""
+Flask CLI Command Extensions
+
+Database schema management commands, run with e.g. ``flask db-upgrade``
+"""
+import click
+from service import app
+from service import migrations
+from service.models import db
+
+
+######################################################################
+# Command to upgrade the database schema
+######################################################################
+@app.cli.command("db-upgrade")
+@click.option("--revision", type=int, default=None, help="Schema version to upgrade to (default: latest)")
+def db_upgrade(revision):
+    """Creates the tables and applies the schema migrations"""
+    db.create_all()
+    version = migrations.upgrade(db.engine, revision)
+    click.echo(f"Database schema is at version {version}")
+
+
+######################################################################
+# Command to downgrade the database schema
+######################################################################
+@app.cli.command("db-downgrade")
+@click.option("--revision", type=int, required=True, help="Schema version to downgrade to")
+def db_downgrade(revision):
+    """Reverts the schema migrations above a version"""
+    version = migrations.downgrade(db.engine, revision)
+    click.echo(f"Database schema is at version {version}")
+
+
+######################################################################
+# Command to show the database schema version
+######################################################################
+@app.cli.command("db-version")
+def db_version():
+    """Shows the schema version of the database"""
+    with db.engine.connect() as connection:
+        version = migrations.current_version(connection)
+    click.echo(f"Database schema is at version {version} (latest is {migrations.HEAD})")
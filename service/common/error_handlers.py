@@ -17,7 +17,9 @@
 """
 Module: error_handlers
 """
-from service.models import DataValidationError
+from flask import request
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import DataValidationError, db
 from service import app, api
 from . import status
 
@@ -35,3 +37,22 @@ def request_validation_error(error):
         'error': 'Bad Request',
         'message': message
     }, status.HTTP_400_BAD_REQUEST
+
+
+@api.errorhandler(StaleDataError)
+def concurrent_update_error(error):
+    """ Handles writes to a Shopcart that another request changed after it was read """
+    db.session.rollback()
+    message = str(error)
+    app.logger.warning(message)
+    if request.if_match:
+        return {
+            'status_code': status.HTTP_412_PRECONDITION_FAILED,
+            'error': 'Precondition Failed',
+            'message': message
+        }, status.HTTP_412_PRECONDITION_FAILED
+    return {
+        'status_code': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
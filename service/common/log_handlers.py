@@ -19,18 +19,131 @@ Log Handlers
 
 This module contains utility functions to set up logging
 consistently
+
+The app logger only puts its records on a queue, and a listener thread of
+each process writes them to the gunicorn handlers, so a request never waits
+on log I/O. The records are written as one JSON object per line (LOG_FORMAT)
+with the fields passed in ``extra``. The lookups run by every read request log
+with ``extra=HOT_PATH`` and only LOG_SAMPLE_RATE of them are kept; the
+messages of the writes are never sampled.
 """
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# extra of the messages logged by the read lookups of every request, which are sampled
+HOT_PATH = {"sampled": True}
+
+# attributes of every LogRecord, the others were passed in extra
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sampled"}
+
+# the queue handler of the app logger and the listener writing out its records in this process
+_handler = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a JSON object on a single line"""
+
+    def format(self, record):
+        document = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                document[key] = value
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatException(record.exc_info)
+        if record.exc_text:
+            document["exception"] = record.exc_text
+        return json.dumps(document, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records logged with extra=HOT_PATH and all of the others"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        if random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class LogQueueHandler(QueueHandler):
+    """Puts the records on a queue with their message already formatted"""
+
+    def prepare(self, record):
+        # the arguments may be objects that are not safe to read from the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
+    global _handler  # pylint: disable=global-statement
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
+    for handler in gunicorn_logger.handlers:
         handler.setFormatter(formatter)
+
+    stop_listener()
+    _handler = LogQueueHandler(queue.SimpleQueue())
+    _handler.addFilter(SamplingFilter(app.config.get("LOG_SAMPLE_RATE", 1.0)))
+    app.logger.handlers = [_handler]
+    _start_listener(gunicorn_logger.handlers)
     app.logger.info("Logging handler established")
+
+
+def _start_listener(handlers):
+    """Starts a thread writing the records of the queue to handlers"""
+    global _listener  # pylint: disable=global-statement
+    _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_listener():
+    """Writes the records left on the queue and stops the thread"""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener():
+    """Starts the listener of a forked process on a new queue, the thread of the parent is not in the child"""
+    if _listener is not None:
+        _handler.queue = queue.SimpleQueue()
+        _start_listener(_listener.handlers)
+
+
+atexit.register(stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener)
@@ -0,0 +1,104 @@
+"""
+Metrics
+
+Prometheus metrics of the requests served by the app and of the SQL they
+send, exposed by GET /metrics. The metrics are labelled with the endpoint
+(the Resource of flask-restx or the view function) and the method, never
+with the URL, so their number stays bounded.
+
+Under gunicorn every worker has its own counters. When
+PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py sets it) the workers
+write them to files in that directory and /metrics aggregates the files of
+all of them, whichever worker answers, so histograms can be summed into a
+p99 of the whole pod. The directory must be emptied when the server starts
+and a dead worker marked with mark_process_dead(), see gunicorn.conf.py.
+"""
+import os
+import time
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from . import query_stats, status
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to answer a request",
+    ["endpoint", "method"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    "http_requests", "Requests answered, by status code",
+    ["endpoint", "method", "status"],
+)
+REQUEST_SIZE = Histogram(
+    "http_request_size_bytes", "Size of the request bodies",
+    ["endpoint", "method"], buckets=SIZE_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of the response bodies, streamed ones excepted",
+    ["endpoint", "method"], buckets=SIZE_BUCKETS,
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being answered",
+    ["endpoint", "method"], multiprocess_mode="livesum",
+)
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements sent to answer a request",
+    ["endpoint", "method"], buckets=QUERY_BUCKETS,
+)
+DB_LATENCY = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL statements to answer a request",
+    ["endpoint", "method"], buckets=LATENCY_BUCKETS,
+)
+
+
+def init_metrics(app):
+    """Installs the request hooks and the /metrics endpoint"""
+    query_stats.install()
+
+    @app.before_request
+    def start_request():  # pylint: disable=unused-variable
+        g.metrics_labels = (request.endpoint or "unmatched", request.method)
+        g.metrics_start = time.perf_counter()
+        query_stats.collect()
+        IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+    @app.after_request
+    def record_request(response):  # pylint: disable=unused-variable
+        labels = g.get("metrics_labels")
+        if labels is None:
+            return response
+        REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - g.metrics_start)
+        REQUESTS.labels(*labels, response.status_code).inc()
+        REQUEST_SIZE.labels(*labels).observe(request.content_length or 0)
+        if not response.is_streamed:
+            RESPONSE_SIZE.labels(*labels).observe(response.calculate_content_length() or 0)
+        stats = query_stats.current()
+        if stats is not None:
+            DB_QUERIES.labels(*labels).observe(stats.count)
+            DB_LATENCY.labels(*labels).observe(stats.seconds)
+        return response
+
+    @app.teardown_request
+    def end_request(exc):  # pylint: disable=unused-variable,unused-argument
+        labels = g.pop("metrics_labels", None)
+        if labels is not None:
+            IN_PROGRESS.labels(*labels).dec()
+        query_stats.reset()
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():  # pylint: disable=unused-variable
+        """ Returns the metrics of all the workers in the Prometheus text format """
+        return Response(generate_latest(registry()), status.HTTP_200_OK, content_type=CONTENT_TYPE_LATEST)
+
+
+def registry():
+    """Returns the registry of this process, or one aggregating all of the workers"""
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    aggregate = CollectorRegistry()
+    multiprocess.MultiProcessCollector(aggregate)
+    return aggregate
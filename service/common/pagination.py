@@ -0,0 +1,34 @@
+"""
+Pagination
+
+This module contains utility functions for keyset (cursor based) pagination.
+The cursor handed to clients is opaque: it wraps the id of the last record
+of a page so the next page can be fetched with ``WHERE id > :after`` instead
+of an OFFSET scan.
+"""
+import base64
+import binascii
+
+from service.models import DataValidationError
+
+
+def encode_cursor(last_id: int) -> str:
+    """Returns the opaque cursor pointing after the record with last_id"""
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Returns the record id wrapped by a cursor from encode_cursor()"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, last_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        if prefix != "id":
+            raise ValueError(prefix)
+        return int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as error:
+        raise DataValidationError(f"Invalid pagination cursor: {cursor}") from error
+
+
+def link_header(url: str, rel: str = "next") -> str:
+    """Formats an RFC 8288 Link header value"""
+    return f'<{url}>; rel="{rel}"'
@@ -0,0 +1,142 @@
+"""
+Profiler
+
+Opt-in profiling of single requests in production. init_profiler() does
+nothing unless PROFILER_ENABLED is set, so a disabled profiler adds no hook
+to the requests at all. When it is enabled, a request is profiled if it
+sends the PROFILER_HEADER with the PROFILER_TOKEN, or at random with the
+PROFILER_SAMPLE_RATE.
+
+A profiled request runs under cProfile while the SQL statements it sends
+are timed by query_stats. Its call stacks are written to PROFILER_DIR as
+<name>.prof (open them with pstats or snakeviz) next to a <name>.json
+summary of the request and its database time, only the last PROFILER_KEEP
+profiles are kept, and GET /profiles lists them to the requests that send
+the token (nobody when PROFILER_TOKEN is empty).
+"""
+import cProfile
+import hmac
+import json
+import os
+import random
+import time
+import uuid
+from flask import Response, abort, current_app, g, jsonify, request
+from . import query_stats, status
+
+
+def init_profiler(app):
+    """Installs the request hooks and the /profiles endpoint when PROFILER_ENABLED is set"""
+    if not app.config.get("PROFILER_ENABLED"):
+        return
+    os.makedirs(app.config["PROFILER_DIR"], exist_ok=True)
+    query_stats.install()
+    app.before_request(start_profile)
+    app.after_request(write_profile)
+    app.teardown_request(stop_profile)
+    app.add_url_rule("/profiles", view_func=list_profiles, methods=["GET"])
+    app.add_url_rule("/profiles/<name>", view_func=read_profile, methods=["GET"])
+
+
+def start_profile():
+    """Starts profiling the request if it is trusted or sampled"""
+    if not _should_profile(current_app.config):
+        return
+    query_stats.collect(keep_statements=True)
+    g.profile = cProfile.Profile()
+    g.profile_start = time.perf_counter()
+    g.profile.enable()
+
+
+def write_profile(response):
+    """Saves the profile of a profiled request and names it in the X-Profile header"""
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.disable()
+        seconds = time.perf_counter() - g.pop("profile_start")
+        name = _save(current_app.config, profile, response.status_code, seconds, query_stats.current().statements)
+        response.headers["X-Profile"] = name
+    return response
+
+
+def stop_profile(exc):  # pylint: disable=unused-argument
+    """Stops the profiler of a request that failed before after_request"""
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.disable()
+    query_stats.reset()
+
+
+def list_profiles():
+    """ Lists the recent profiles of this worker, newest first """
+    # the profiles hold SQL statements and call stacks, only the token may read them
+    if not _trusted(current_app.config):
+        abort(status.HTTP_403_FORBIDDEN)
+    return jsonify(recent_profiles(current_app.config["PROFILER_DIR"])), status.HTTP_200_OK
+
+
+def read_profile(name):
+    """ Returns the call stacks of a profile in the pstats format """
+    if not _trusted(current_app.config):
+        abort(status.HTTP_403_FORBIDDEN)
+    path = os.path.join(current_app.config["PROFILER_DIR"], os.path.basename(name) + ".prof")
+    if not os.path.isfile(path):
+        abort(status.HTTP_404_NOT_FOUND)
+    with open(path, "rb") as file:
+        return Response(file.read(), mimetype="application/octet-stream")
+
+
+def recent_profiles(directory):
+    """Returns the summaries of the profiles in directory, newest first"""
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".json"):
+            try:
+                with open(entry.path, encoding="utf-8") as file:
+                    profiles.append(json.load(file))
+            except (OSError, ValueError):
+                continue  # pruned or still being written by another worker
+    return sorted(profiles, key=lambda profile: profile["started"], reverse=True)
+
+
+def _trusted(config):
+    token = config["PROFILER_TOKEN"]
+    return bool(token) and hmac.compare_digest(request.headers.get(config["PROFILER_HEADER"], ""), token)
+
+
+def _should_profile(config):
+    if request.path.startswith("/profiles"):
+        return False
+    return _trusted(config) or random.random() < config["PROFILER_SAMPLE_RATE"]
+
+
+def _save(config, profile, status_code, seconds, queries):
+    """Writes the profile and its summary, prunes the old ones and returns its name"""
+    started = time.time() - seconds
+    name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(started))}-{uuid.uuid4().hex[:8]}"
+    directory = config["PROFILER_DIR"]
+    profile.dump_stats(os.path.join(directory, name + ".prof"))
+    summary = {
+        "name": name,
+        "started": started,
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "status": status_code,
+        "seconds": seconds,
+        "db_seconds": sum(duration for _, duration in queries),
+        "queries": len(queries),
+        # the slowest statements, the full call stacks are in the .prof file
+        "slowest_queries": [
+            {"statement": statement, "seconds": duration}
+            for statement, duration in sorted(queries, key=lambda query: query[1], reverse=True)[:5]
+        ],
+    }
+    with open(os.path.join(directory, name + ".json"), "w", encoding="utf-8") as file:
+        json.dump(summary, file)
+    for old in recent_profiles(directory)[config["PROFILER_KEEP"]:]:
+        for extension in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(directory, old["name"] + extension))
+            except OSError:
+                pass  # already pruned by another worker
+    return name
@@ -0,0 +1,69 @@
+"""
+Query Stats
+
+Counts and times the SQL statements sent by the request being served by a
+thread. The request hooks of the metrics and of the profiler call collect()
+when a request starts and reset() when it ends; the engine listeners
+installed by install() only do work while a request is being collected.
+"""
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+class QueryStats:
+    """The number of statements of one request and the seconds spent in them"""
+
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # (statement, seconds) of every statement, only when a collector asked for them
+        self.statements = None
+
+
+def install():
+    """Installs the listeners on every engine, once"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def collect(keep_statements=False):
+    """Returns the stats of the current request, starting them if needed"""
+    stats = getattr(_local, "stats", None)
+    if stats is None:
+        stats = _local.stats = QueryStats()
+    if keep_statements and stats.statements is None:
+        stats.statements = []
+    return stats
+
+
+def current():
+    """Returns the stats of the current request, None if it is not collected"""
+    return getattr(_local, "stats", None)
+
+
+def reset():
+    """Stops collecting the stats of the current request"""
+    _local.stats = None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    if getattr(_local, "stats", None) is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    stats = getattr(_local, "stats", None)
+    if stats is None or not conn.info.get("query_start"):
+        return
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    stats.count += 1
+    stats.seconds += seconds
+    if stats.statements is not None:
+        stats.statements.append((statement, seconds))
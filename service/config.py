@@ -2,6 +2,7 @@
 Global Configuration for Application
 """
 import os
+from service.common.db_pool import InstrumentedQueuePool
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -12,5 +13,59 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# seconds after which a connection is replaced, keep it below any server or proxy idle timeout
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# test connections on checkout so ones dropped while idle or by a failover are replaced
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "poolclass": InstrumentedQueuePool,
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Logging: "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# fraction of the messages logged by the read lookups (extra=HOT_PATH) that are kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Keyset pagination of GET /api/shopcarts
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Number of shopcarts fetched per round trip by GET /api/shopcarts/export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# Read-through cache of serialized shopcarts: "local" (per worker process) or "null"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "1000"))
+# seconds a cached shopcart may be served, bounds staleness across workers
+CACHE_TTL = float(os.getenv("CACHE_TTL", "10"))
+
+# Report of GET /api/analytics, computed over the whole tables and reused by each worker
+ANALYTICS_REFRESH_INTERVAL = float(os.getenv("ANALYTICS_REFRESH_INTERVAL", "60"))
+# seconds without a change after which a shopcart with items counts as abandoned
+ANALYTICS_ABANDONED_AFTER = float(os.getenv("ANALYTICS_ABANDONED_AFTER", "86400"))
+# number of customers, item names and item colors in the top lists
+ANALYTICS_TOP = int(os.getenv("ANALYTICS_TOP", "10"))
+
+# Opt-in profiler of single requests, see service/common/profiler.py
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() in ("true", "1", "yes")
+# a request that sends PROFILER_HEADER with the PROFILER_TOKEN is profiled, an empty token trusts nobody
+PROFILER_HEADER = os.getenv("PROFILER_HEADER", "X-Profile-Token")
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+# fraction of the other requests that are profiled at random
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_DIR = os.getenv("PROFILER_DIR", "/tmp/profiles")
+# number of profiles kept in PROFILER_DIR, the oldest are removed
+PROFILER_KEEP = int(os.getenv("PROFILER_KEEP", "100"))
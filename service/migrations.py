@@ -0,0 +1,152 @@
+"""
+Schema Migrations
+
+Versioned upgrade and downgrade steps for the shopcart schema.
+
+db.create_all() only creates missing tables, so changes to existing tables
+(indexes, constraints, columns) are listed here in order. The version applied
+to a database is kept in the schema_version table. Every step is written to
+be idempotent, so a schema freshly made by db.create_all() can be upgraded
+safely as well.
+
+Run them with the Flask CLI:
+    flask db-upgrade [--revision N]
+    flask db-downgrade --revision N
+    flask db-version
+"""
+import logging
+from collections import namedtuple
+from sqlalchemy import Column, Integer, MetaData, Table, select, text
+
+logger = logging.getLogger("flask.app")
+
+Migration = namedtuple("Migration", ["version", "description", "upgrade", "downgrade"])
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "Index item.shopcart_id and shopcart.customer_id",
+        upgrade=[
+            "CREATE INDEX IF NOT EXISTS ix_item_shopcart_id ON item (shopcart_id)",
+            "CREATE INDEX IF NOT EXISTS ix_shopcart_customer_id ON shopcart (customer_id)",
+        ],
+        downgrade=[
+            "DROP INDEX IF EXISTS ix_shopcart_customer_id",
+            "DROP INDEX IF EXISTS ix_item_shopcart_id",
+        ],
+    ),
+    Migration(
+        2,
+        "Add shopcart.version, bumped by every change to a shopcart or its items",
+        upgrade=[
+            "ALTER TABLE shopcart ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+        ],
+        downgrade=[
+            "ALTER TABLE shopcart DROP COLUMN IF EXISTS version",
+        ],
+    ),
+    Migration(
+        3,
+        "Unique key on item (shopcart_id, id), which replaces the index on item.shopcart_id",
+        upgrade=[
+            """
+            DO $$ BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_item_shopcart_id_id') THEN
+                    ALTER TABLE item ADD CONSTRAINT uq_item_shopcart_id_id UNIQUE (shopcart_id, id);
+                END IF;
+            END $$
+            """,
+            "DROP INDEX IF EXISTS ix_item_shopcart_id",
+        ],
+        downgrade=[
+            "CREATE INDEX IF NOT EXISTS ix_item_shopcart_id ON item (shopcart_id)",
+            "ALTER TABLE item DROP CONSTRAINT IF EXISTS uq_item_shopcart_id_id",
+        ],
+    ),
+    Migration(
+        4,
+        "Delete the items of a shopcart with it through ON DELETE CASCADE",
+        upgrade=[
+            "ALTER TABLE item DROP CONSTRAINT IF EXISTS item_shopcart_id_fkey, "
+            "ADD CONSTRAINT item_shopcart_id_fkey FOREIGN KEY (shopcart_id) REFERENCES shopcart (id) ON DELETE CASCADE",
+        ],
+        downgrade=[
+            "ALTER TABLE item DROP CONSTRAINT IF EXISTS item_shopcart_id_fkey, "
+            "ADD CONSTRAINT item_shopcart_id_fkey FOREIGN KEY (shopcart_id) REFERENCES shopcart (id)",
+        ],
+    ),
+    Migration(
+        5,
+        "Add shopcart.updated_at, set whenever the version is bumped",
+        upgrade=[
+            "ALTER TABLE shopcart ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()",
+        ],
+        downgrade=[
+            "ALTER TABLE shopcart DROP COLUMN IF EXISTS updated_at",
+        ],
+    ),
+]
+
+HEAD = MIGRATIONS[-1].version
+
+# advisory lock that serializes migrations run by several workers at once
+LOCK_ID = 2820
+
+schema_version = Table(
+    "schema_version", MetaData(), Column("version", Integer, nullable=False)
+)
+
+
+def _lock(connection):
+    """Waits until no other process is migrating, the lock is released on commit"""
+    connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": LOCK_ID})
+
+
+def current_version(connection) -> int:
+    """Returns the schema version of the database, 0 if it was never migrated"""
+    schema_version.create(connection, checkfirst=True)
+    version = connection.execute(select(schema_version.c.version)).scalar()
+    return version or 0
+
+
+def _set_version(connection, version: int):
+    """Records the schema version of the database"""
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert().values(version=version))
+
+
+def upgrade(engine, target: int = None) -> int:
+    """Applies the migrations up to target (default: the latest) in one transaction
+
+    Returns the schema version of the database afterwards
+    """
+    target = HEAD if target is None else target
+    with engine.begin() as connection:
+        _lock(connection)
+        version = current_version(connection)
+        for migration in MIGRATIONS:
+            if version < migration.version <= target:
+                logger.info("Upgrading schema to version %d: %s", migration.version, migration.description)
+                for statement in migration.upgrade:
+                    connection.execute(text(statement))
+                version = migration.version
+        _set_version(connection, version)
+    return version
+
+
+def downgrade(engine, target: int) -> int:
+    """Reverts the migrations above target in one transaction
+
+    Returns the schema version of the database afterwards
+    """
+    with engine.begin() as connection:
+        _lock(connection)
+        version = current_version(connection)
+        for migration in reversed(MIGRATIONS):
+            if target < migration.version <= version:
+                logger.info("Downgrading schema from version %d: %s", migration.version, migration.description)
+                for statement in migration.downgrade:
+                    connection.execute(text(statement))
+                version = migration.version - 1
+        _set_version(connection, version)
+    return version
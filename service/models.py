@@ -3,14 +3,37 @@ Models for shopcart
 
 All of the models are stored in this module
 """
+import hashlib
 import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Boolean, and_, column, delete, desc, func, literal_column, select, true, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from service import migrations
+from service.common.cache import Cache
+from service.common.log_handlers import HOT_PATH
 
 logger = logging.getLogger("flask.app")
 
-# Create the SQLAlchemy object to be initialized later in init_db()
+# Create the SQLAlchemy object to be initialized later in init_app()
 db = SQLAlchemy()
 
+# Cache of serialized Shopcarts, its backend is chosen in init_app()
+cache = Cache()
+
+# Strategies for loading relationships in bulk, see PersistentBase.eager_query()
+# None leaves the relationship lazy (one extra SELECT per parent when touched)
+LOAD_STRATEGIES = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    None: None,
+}
+DEFAULT_LOAD_STRATEGY = "selectin"
+
 
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
@@ -22,52 +45,129 @@ class DataValidationError(Exception):
 class PersistentBase:
     """Base class added persistent methods"""
 
+    # names of the relationships serialize() walks, loaded in bulk by eager_query()
+    eager_relationships = ()
+
     def __init__(self):
         self.id = None  # pylint: disable=invalid-name
 
+    def cache_key(self):
+        """Returns the cache key of this record, records cached as part of a Shopcart return its key"""
+        return f"{self.__tablename__}:{self.id}"
+
+    def touch(self):
+        """Bumps the version of the Shopcart this record is part of, if it is versioned"""
+
     def create(self):
         """
         Creates a item/shopcart to the database
         """
         logger.info("Creating shopcart")
         self.id = None  # id must be none to generate next primary key
+        self.touch()
         db.session.add(self)
+        db.session.flush()  # assigns the id used in the cache key
+        key = self.cache_key()
         db.session.commit()
+        cache.delete(key)
 
     def update(self):
         """
         Updates a item/shopcart to the database
         """
         logger.info("Updating shopcart")
+        self.touch()
+        db.session.flush()
+        key = self.cache_key()
         db.session.commit()
+        cache.delete(key)
 
     def delete(self):
         """Removes a Shopcart from the data store"""
         logger.info("Deleting shopcart")
+        key = self.cache_key()
+        self.touch()
         db.session.delete(self)
         db.session.commit()
+        cache.delete(key)
 
     @classmethod
-    def init_db(cls, app):
-        """Initializes the database session"""
+    def init_app(cls, app):
+        """Binds the database session and the cache to the Flask app
+
+        Nothing is connected here: the engine opens its first connection when
+        a request uses it, and the schema is managed by ``flask db-upgrade``.
+        """
         logger.info("Initializing database")
         cls.app = app
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
+        cache.init_app(app)
+        Analytics.init_app(app)
+
+    @classmethod
+    def init_db(cls, app):
+        """Initializes the database session and brings the schema up to date, for tests and scripts"""
+        cls.init_app(app)
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
+        migrations.upgrade(db.engine)  # bring tables made by older releases up to date
 
     @classmethod
-    def all(cls):
-        """Returns all of the records in the database"""
-        logger.info("Processing all records")
-        return cls.query.all()
+    def eager_query(cls, strategy=DEFAULT_LOAD_STRATEGY):
+        """Returns a query that loads the eager relationships with the given strategy
+
+        Args:
+            strategy (str): "selectin", "joined" or None to leave them lazy
+        """
+        if strategy not in LOAD_STRATEGIES:
+            raise ValueError(f"Unknown load strategy: {strategy}")
+        query = cls.query
+        loader = LOAD_STRATEGIES[strategy]
+        if loader:
+            query = query.options(
+                *[loader(getattr(cls, name)) for name in cls.eager_relationships]
+            )
+        return query
 
     @classmethod
-    def find(cls, by_id):
+    def keyset_page(cls, query, after_id=None, limit=None):
+        """Orders a query by id and restricts it to one page of records
+
+        Args:
+            query (Query): the query to paginate
+            after_id (int): only return records with an id greater than this one
+            limit (int): the maximum number of records to return
+        """
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        query = query.order_by(cls.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    @classmethod
+    def all(cls, strategy=DEFAULT_LOAD_STRATEGY, **page):
+        """Returns all of the records in the database, page holds the after_id and limit of keyset_page()"""
+        logger.info("Processing all records", extra=HOT_PATH)
+        return cls.keyset_page(cls.eager_query(strategy), **page).all()
+
+    @classmethod
+    def stream_all(cls, batch_size):
+        """Yields all of the records ordered by id, fetching batch_size at a time
+
+        The rows are read from a server-side cursor and the eager relationships
+        are loaded once per batch, so memory use does not grow with the table.
+        """
+        logger.info("Streaming all records in batches of %s", batch_size)
+        query = cls.eager_query("selectin").order_by(cls.id)
+        yield from query.execution_options(stream_results=True).yield_per(batch_size)
+
+    @classmethod
+    def find(cls, by_id, strategy=DEFAULT_LOAD_STRATEGY):
         """Finds a record by it's ID"""
-        logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        logger.info("Processing lookup for id %s ...", by_id, extra=HOT_PATH)
+        return cls.eager_query(strategy).get(by_id)
 
 
 ######################################################################
@@ -79,15 +179,28 @@ class Item(db.Model, PersistentBase):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    shopcart_id = db.Column(db.Integer, db.ForeignKey("shopcart.id"), nullable=False)
+    # deleting a Shopcart deletes its Items in the database, see migration 4
+    shopcart_id = db.Column(db.Integer, db.ForeignKey("shopcart.id", ondelete="CASCADE"), nullable=False)
     name = db.Column(db.String(64), nullable=False)
     price = db.Column(db.Float, nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     color = db.Column(db.String(16))
 
+    # also serves every lookup of the Items of a Shopcart, see migration 3
+    __table_args__ = (db.UniqueConstraint("shopcart_id", "id", name="uq_item_shopcart_id_id"),)
+
     def __repr__(self):
         return f"<Item {self.name} id=[{self.id}] shopcart[{self.shopcart_id}]>"
 
+    def cache_key(self):
+        """Returns the key of the cached Shopcart that contains this Item"""
+        return Shopcart.key_for(self.shopcart_id)
+
+    def touch(self):
+        """Bumps the version of the Shopcart that contains this Item"""
+        if self.shopcart_id is not None:
+            Shopcart.bump_version(self.shopcart_id)
+
     def serialize(self):
         """ Serializes a Item into a dictionary """
         return {"id": self.id,
@@ -106,6 +219,9 @@ class Item(db.Model, PersistentBase):
         """
         try:
             self.id = data["id"]
+            # a null id is given by the sequence, anything else must be an integer
+            if self.id is not None and (isinstance(self.id, bool) or not isinstance(self.id, int)):
+                raise DataValidationError("Invalid Item: id must be an integer or null")
             self.shopcart_id = data["shopcart_id"]
             self.name = data["name"]
             self.price = data["price"]
@@ -122,6 +238,167 @@ class Item(db.Model, PersistentBase):
             )
         return self
 
+    @classmethod
+    def add_to_shopcart(cls, shopcart_id, items, versions=None):
+        """Adds Items to a Shopcart with one atomic INSERT ... ON CONFLICT statement
+
+        Items whose id is already in the Shopcart get their quantity increased
+        instead, and repeated ids in the list are merged first. Items whose id
+        belongs to another Shopcart are left untouched. Items without an id get
+        the next ones of the sequence first and are only ever inserted; if the
+        sequence is behind ids that were posted explicitly, it is moved past
+        them and the Items get new ids. The version of the Shopcart is
+        bumped by the same statement, which inserts nothing when the Shopcart
+        does not exist or its version is not one of the given versions, and is
+        rolled back when no Item was added.
+
+        Args:
+            shopcart_id (int): the id of the Shopcart to add the Items to
+            items (list): the deserialized Items to add
+            versions (list): the versions the Shopcart may have, None for any
+        Returns:
+            dict: maps each Item id to a tuple of the resulting Item and whether it
+                was created, or to None if it was not added
+        """
+        logger.info("Adding %d items to shopcart %s", len(items), shopcart_id)
+        missing = [item for item in items if item.id is None]
+        results = cls._upsert(shopcart_id, items, versions, missing)
+        if any(results[item.id] is None for item in missing):
+            # an id drawn from the sequence is taken, move the sequence past the ids and draw again
+            db.session.rollback()
+            db.session.execute(cls.sync_ids_statement())
+            results = cls._upsert(shopcart_id, items, versions, missing)
+        if not any(results.values()):
+            # nothing was written, the bump of the version must not change the ETag
+            db.session.rollback()
+            return results
+        db.session.commit()
+        cache.delete(Shopcart.key_for(shopcart_id))
+        return results
+
+    @classmethod
+    def _upsert(cls, shopcart_id, items, versions, missing):
+        """Gives the missing Items new ids and runs the statement of upsert_statement()"""
+        if missing:
+            cls.assign_ids(missing, db.session.execute(cls.next_ids_statement(len(missing))).scalars())
+        statement, results = cls.upsert_statement(shopcart_id, items, versions, [item.id for item in missing])
+        return cls.read_upserted(db.session.execute(statement), results)
+
+    @classmethod
+    def next_ids_statement(cls, count):
+        """Builds the statement that draws count ids from the sequence of the Item ids"""
+        sequence = func.pg_get_serial_sequence(cls.__table__.name, "id")
+        return select(func.nextval(sequence)).select_from(func.generate_series(1, count))
+
+    @classmethod
+    def sync_ids_statement(cls):
+        """Builds the statement that moves the sequence of the Item ids past the largest id"""
+        sequence = func.pg_get_serial_sequence(cls.__table__.name, "id")
+        return select(func.setval(sequence, select(func.max(cls.id)).scalar_subquery()))
+
+    @staticmethod
+    def assign_ids(items, ids):
+        """Gives Items posted without an id the ids drawn by next_ids_statement()"""
+        for item, item_id in zip(items, ids):
+            item.id = item_id
+
+    @classmethod
+    def upsert_statement(cls, shopcart_id, items, versions=None, new_ids=()):
+        """Builds the statement of add_to_shopcart(), for any session to execute
+
+        The Items with one of new_ids, drawn from the sequence, are only inserted
+        and never merged into an existing Item.
+
+        Returns:
+            tuple: the statement and the results dict to fill with read_upserted()
+        """
+        rows = {}
+        for item in items:
+            if item.id in rows:
+                rows[item.id]["quantity"] += item.quantity
+            else:
+                rows[item.id] = dict(item.serialize(), shopcart_id=shopcart_id)
+
+        # the rows are only inserted if the UPDATE of the Shopcart finds it
+        shopcarts = Shopcart.__table__
+        bump = update(shopcarts).where(shopcarts.c.id == shopcart_id)
+        if versions is not None:
+            bump = bump.where(shopcarts.c.version.in_(versions))
+        bumped = bump.values(version=shopcarts.c.version + 1).returning(shopcarts.c.id).cte("bumped")
+        table = cls.__table__
+        columns = [table.c.id, table.c.name, table.c.price, table.c.quantity, table.c.color]
+        new_items = values(*[column(col.name, col.type) for col in columns], name="new_items").data(
+            [tuple(row[col.name] for col in columns) for row in rows.values()]
+        )
+        statement = insert(table).from_select(
+            [col.name for col in columns] + ["shopcart_id"],
+            select(*new_items.c, bumped.c.id).select_from(new_items.join(bumped, true())),
+        )
+        merge = table.c.shopcart_id == statement.excluded.shopcart_id
+        if new_ids:
+            merge = and_(merge, table.c.id.notin_(new_ids))
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={"quantity": table.c.quantity + statement.excluded.quantity},
+            where=merge,
+        ).returning(
+            *table.columns,
+            # xmax is only zero on rows this statement inserted, written inline as
+            # SQLAlchemy misplaces a bound parameter here for positional drivers (asyncpg)
+            literal_column("xmax = 0", Boolean).label("created"),
+        )
+        return statement, dict.fromkeys(rows)
+
+    @classmethod
+    def read_upserted(cls, rows, results):
+        """Fills the results of upsert_statement() from the rows it returned"""
+        # read the rows by position, the names of the CTE make the ones of the result ambiguous
+        names = [col.name for col in cls.__table__.columns]
+        for *fields, created in rows:
+            item = cls(**dict(zip(names, fields)))
+            results[item.id] = (item, created)
+        return results
+
+    @classmethod
+    def find_in_shopcart(cls, shopcart_id, item_id):
+        """Finds an Item of a Shopcart with one lookup on the (shopcart_id, id) unique key"""
+        logger.info("Processing lookup for item %s in shopcart %s ...", item_id, shopcart_id, extra=HOT_PATH)
+        return cls.query.filter(cls.shopcart_id == shopcart_id, cls.id == item_id).one_or_none()
+
+    @classmethod
+    def find_shopcart_ids(cls, item_ids):
+        """Returns a dict that maps each of the given Item ids that exists to its Shopcart id"""
+        logger.info("Processing shopcart lookup for %d items ...", len(item_ids), extra=HOT_PATH)
+        rows = db.session.query(cls.id, cls.shopcart_id).filter(cls.id.in_(item_ids))
+        return dict(rows.all())
+
+    @classmethod
+    def checkout(cls, shopcart_id, item_ids):
+        """Removes Items from a Shopcart with one DELETE ... RETURNING statement
+
+        Either all of the Items are removed or, if some of them are no longer
+        in the Shopcart, the transaction is rolled back and None is returned.
+
+        Args:
+            shopcart_id (int): the id of the Shopcart to check the Items out of
+            item_ids (list): the ids of the Items to check out
+        Returns:
+            list: the removed Items
+        """
+        logger.info("Checking out %d items from shopcart %s", len(item_ids), shopcart_id)
+        table = cls.__table__
+        statement = delete(table).where(
+            table.c.shopcart_id == shopcart_id, table.c.id.in_(item_ids)
+        ).returning(*table.columns)
+        checked_out = [cls(**row) for row in db.session.execute(statement).mappings()]
+        if len(checked_out) != len(set(item_ids)):
+            db.session.rollback()
+            return None
+        Shopcart.bump_version(shopcart_id)
+        db.session.commit()
+        cache.delete(Shopcart.key_for(shopcart_id))
+        return checked_out
+
 
 ######################################################################
 #  S H O P C A R T   M O D E L
@@ -132,12 +409,53 @@ class Shopcart(db.Model, PersistentBase):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, nullable=False)
+    customer_id = db.Column(db.Integer, nullable=False, index=True)
+    # bumped by every change to the shopcart or its items, the ETag is derived from it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # set by the database whenever the version is bumped, abandoned shopcarts are found by it
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
     items = db.relationship("Item", backref="shopcart", passive_deletes=True)
 
+    # optimistic concurrency: the ORM updates a loaded Shopcart only if its version
+    # is still the one it was loaded with, and raises StaleDataError otherwise
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
+
+    eager_relationships = ("items",)
+
     def __repr__(self):
         return f"<Shopcart {self.id} customer {self.customer_id}>"
 
+    @staticmethod
+    def key_for(shopcart_id):
+        """Returns the cache key of the Shopcart with the given id"""
+        return f"shopcart:{shopcart_id}"
+
+    def cache_key(self):
+        """Returns the cache key of this Shopcart"""
+        return self.key_for(self.id)
+
+    def touch(self):
+        """Bumps the version of this Shopcart, a new Shopcart starts at version 1"""
+        if self.id is not None:
+            # incremented in SQL so concurrent writers never lose a bump
+            self.version = Shopcart.version + 1
+
+    def clear_items(self):
+        """Deletes all of the Items of this Shopcart with one statement, without loading them"""
+        logger.info("Clearing the items of shopcart %s", self.id)
+        key = self.cache_key()
+        # Items already loaded would refer to deleted rows
+        for item in self.__dict__.get("items", ()):
+            db.session.expunge(item)
+        table = Item.__table__
+        db.session.execute(delete(table).where(table.c.shopcart_id == self.id))
+        self.touch()
+        db.session.flush()
+        db.session.commit()
+        # the Shopcart is known to be empty, so reading its items does not query them
+        set_committed_value(self, "items", [])
+        cache.delete(key)
+
     def serialize(self):
         """ Serializes a Shopcart into a dictionary """
         shopcart = {"id": self.id, "customer_id": self.customer_id, "items": []}
@@ -171,32 +489,289 @@ class Shopcart(db.Model, PersistentBase):
         return self
 
     @classmethod
-    def find_by_shopcart_id_and_customer_id(cls, shopcart_id, customer_id):
+    def delete_by_id(cls, shopcart_id):
+        """Deletes a Shopcart and, by the cascade of the foreign key, its Items with one statement
+
+        Returns:
+            bool: whether the Shopcart existed
+        """
+        logger.info("Deleting shopcart %s", shopcart_id)
+        table = cls.__table__
+        result = db.session.execute(delete(table).where(table.c.id == shopcart_id))
+        db.session.commit()
+        cache.delete(cls.key_for(shopcart_id))
+        return result.rowcount > 0
+
+    @classmethod
+    def bump_version(cls, shopcart_id):
+        """Bumps the version of a Shopcart in the current transaction without loading it"""
+        table = cls.__table__
+        db.session.execute(update(table).where(table.c.id == shopcart_id).values(version=table.c.version + 1))
+
+    @staticmethod
+    def etag_for(shopcart_id, version):
+        """Returns the strong entity tag of a version of a Shopcart"""
+        return f"{shopcart_id}-{version}"
+
+    @staticmethod
+    def version_from_etag(shopcart_id, etag):
+        """Returns the version in an entity tag of the Shopcart, None if it is not one of its tags"""
+        prefix = f"{shopcart_id}-"
+        version = etag[len(prefix):]
+        if etag.startswith(prefix) and version.isdigit():
+            return int(version)
+        return None
+
+    @classmethod
+    def list_etag(cls, shopcarts, has_next):
+        """Returns the entity tag of a page of Shopcarts, derived from their ids and versions"""
+        versions = ",".join(cls.etag_for(shopcart.id, shopcart.version) for shopcart in shopcarts)
+        return hashlib.sha1(f"{versions};{has_next}".encode()).hexdigest()
+
+    @classmethod
+    def find_version(cls, shopcart_id):
+        """Returns the version of a Shopcart with a single-row lookup, None if it does not exist"""
+        return db.session.query(cls.version).filter(cls.id == shopcart_id).scalar()
+
+    @classmethod
+    def find_serialized(cls, shopcart_id, version=None):
+        """Returns the version and the serialized Shopcart through the cache
+
+        A cached Shopcart that is not at the given version is reloaded, so
+        passing the version from find_version() keeps workers consistent.
+        The returned dictionary is shared with the cache and must not be modified.
+
+        Returns:
+            tuple: the version and the serialized Shopcart, or None if it does not exist
+        """
+        key = cls.key_for(shopcart_id)
+        cached = cache.get(key)
+        if cached is None or (version is not None and cached["version"] != version):
+            found = cls.find(shopcart_id, strategy="joined")
+            if not found:
+                return None
+            cached = {"version": found.version, "shopcart": found.serialize()}
+            cache.set(key, cached)
+        return cached["version"], cached["shopcart"]
+
+    @classmethod
+    def find_totals(cls, shopcart_ids):
+        """Returns the version and the totals of Shopcarts with one aggregate query
+
+        The totals of a Shopcart are its number of lines (items), of units
+        (the sum of the quantities) and its subtotal (price times quantity).
+
+        Returns:
+            dict: the version and the totals by id of the Shopcarts that exist
+        """
+        logger.info("Processing totals of %d shopcarts ...", len(shopcart_ids), extra=HOT_PATH)
+        query = cls.totals_query(cls.id, cls.version).where(cls.id.in_(shopcart_ids))
+        totals = {}
+        for shopcart_id, version, lines, units, subtotal in db.session.execute(query):
+            totals[shopcart_id] = version, {
+                "shopcart_id": shopcart_id, "lines": lines, "units": units, "subtotal": round(subtotal, 2)
+            }
+        return totals
+
+    @classmethod
+    def totals_query(cls, *columns):
+        """Returns a query of the given columns of every Shopcart with its lines, units and subtotal"""
+        return (
+            select(
+                *columns,
+                func.count(Item.id).label("lines"),
+                func.coalesce(func.sum(Item.quantity), 0).label("units"),
+                func.coalesce(func.sum(Item.price * Item.quantity), 0.0).label("subtotal"),
+            )
+            .outerjoin(Item, Item.shopcart_id == cls.id)
+            .group_by(cls.id)
+        )
+
+    @classmethod
+    def load_items(cls, shopcarts):
+        """Loads the items of Shopcarts fetched with a lazy strategy in one query"""
+        items = {shopcart.id: [] for shopcart in shopcarts}
+        if items:
+            for item in Item.query.filter(Item.shopcart_id.in_(items)).order_by(Item.id):
+                items[item.shopcart_id].append(item)
+        for shopcart in shopcarts:
+            set_committed_value(shopcart, "items", items[shopcart.id])
+        return shopcarts
+
+    @classmethod
+    def find_by_shopcart_id_and_customer_id(cls, shopcart_id, customer_id, strategy=DEFAULT_LOAD_STRATEGY, **page):
         """Returns all Shopcarts with the given shopcart_id and customer_id
 
         Args:
             shopcart_id (int): the id of the Shopcart you want to match
             customer_id (int): the id of the Customer you want to match
+            strategy (str): how to load the items, see eager_query()
+            page: the after_id and limit of the page to return, see keyset_page()
         """
-        logger.info("Processing shopcart_id_and_customer_id query for %s and %s ...", shopcart_id, customer_id)
-        return cls.query.filter(cls.id == shopcart_id, cls.customer_id == customer_id).all()
+        logger.info("Processing shopcart_id_and_customer_id query for %s and %s ...", shopcart_id, customer_id, extra=HOT_PATH)
+        query = cls.eager_query(strategy).filter(cls.id == shopcart_id, cls.customer_id == customer_id)
+        return cls.keyset_page(query, **page).all()
 
     @classmethod
-    def find_by_shopcart_id(cls, shopcart_id):
+    def find_by_shopcart_id(cls, shopcart_id, strategy=DEFAULT_LOAD_STRATEGY, **page):
         """Returns all Shopcarts with the given shopcart_id
 
         Args:
             shopcart_id (int): the id of the Shopcart you want to match
+            strategy (str): how to load the items, see eager_query()
+            page: the after_id and limit of the page to return, see keyset_page()
         """
-        logger.info("Processing id query for %s ...", id)
-        return cls.query.filter(cls.id == shopcart_id).all()
+        logger.info("Processing id query for %s ...", shopcart_id, extra=HOT_PATH)
+        query = cls.eager_query(strategy).filter(cls.id == shopcart_id)
+        return cls.keyset_page(query, **page).all()
 
     @classmethod
-    def find_by_customer_id(cls, customer_id):
+    def find_by_customer_id(cls, customer_id, strategy=DEFAULT_LOAD_STRATEGY, **page):
         """Returns all Shopcarts with the given customer_id
 
         Args:
             customer_id (int): the id of the Customer you want to match
+            strategy (str): how to load the items, see eager_query()
+            page: the after_id and limit of the page to return, see keyset_page()
+        """
+        logger.info("Processing customer_id query for %s ...", customer_id, extra=HOT_PATH)
+        query = cls.eager_query(strategy).filter(cls.customer_id == customer_id)
+        return cls.keyset_page(query, **page).all()
+
+
+######################################################################
+#  A N A L Y T I C S
+######################################################################
+class Analytics:
+    """Aggregates of all of the Shopcarts and Items for the dashboards
+
+    The report is computed by a few grouped queries over the whole tables, so
+    each worker reuses it for ANALYTICS_REFRESH_INTERVAL seconds instead of
+    following every write, and only one request at a time computes it.
+    """
+
+    refresh_interval = 60.0
+    abandoned_after = 86400.0
+    top = 10
+
+    _lock = threading.Lock()
+    _report = None
+    _expires_at = 0.0
+
+    @classmethod
+    def init_app(cls, app):
+        """Reads the settings of the report from the app configuration"""
+        cls.refresh_interval = app.config.get("ANALYTICS_REFRESH_INTERVAL", 60.0)
+        cls.abandoned_after = app.config.get("ANALYTICS_ABANDONED_AFTER", 86400.0)
+        cls.top = app.config.get("ANALYTICS_TOP", 10)
+        cls.clear()
+
+    @classmethod
+    def clear(cls):
+        """Drops the report, the next one is computed again"""
+        with cls._lock:
+            cls._report = None
+            cls._expires_at = 0.0
+
+    @classmethod
+    def report(cls):
+        """Returns the report and the seconds it is still reused for, computing it when it expired"""
+        with cls._lock:
+            now = time.monotonic()
+            if cls._report is None or now >= cls._expires_at:
+                cls._report = cls.compute()
+                cls._expires_at = now + cls.refresh_interval
+            return cls._report, cls._expires_at - now
+
+    @classmethod
+    def compute(cls):
+        """Computes the report with four grouped queries"""
+        logger.info("Computing the shopcart analytics ...")
+        report = {
+            "computed_at": datetime.now(timezone.utc).isoformat(),
+            "refresh_interval": cls.refresh_interval,
+            "customers": cls.carts_per_customer(cls.top),
+            "item_names": cls.popular(Item.name, cls.top),
+            "item_colors": cls.popular(Item.color, cls.top),
+        }
+        report["shopcarts"], report["abandoned"] = cls.per_cart(cls.abandoned_after)
+        return report
+
+    @staticmethod
+    def carts_per_customer(top):
+        """Returns the number of customers, their shopcarts on average and at most, and the top customers"""
+        per_customer = (
+            select(Shopcart.customer_id, func.count().label("shopcarts"))
+            .group_by(Shopcart.customer_id)
+            .subquery()
+        )
+        # the window functions see every customer before the LIMIT keeps the top ones
+        query = (
+            select(
+                per_customer.c.customer_id,
+                per_customer.c.shopcarts,
+                func.count().over(),
+                func.avg(per_customer.c.shopcarts).over(),
+                func.max(per_customer.c.shopcarts).over(),
+            )
+            .order_by(desc(per_customer.c.shopcarts), per_customer.c.customer_id)
+            .limit(top)
+        )
+        rows = db.session.execute(query).all()
+        customers, average, maximum = rows[0][2:] if rows else (0, 0, 0)
+        return {
+            "count": customers,
+            "average_shopcarts": round(float(average), 2),
+            "max_shopcarts": maximum,
+            "top": [{"customer_id": row[0], "shopcarts": row[1]} for row in rows],
+        }
+
+    @staticmethod
+    def per_cart(abandoned_after):
+        """Returns the averages of the shopcarts and the totals of the abandoned ones
+
+        A shopcart is abandoned when it has items and was not changed for
+        abandoned_after seconds.
         """
-        logger.info("Processing customer_id query for %s ...", customer_id)
-        return cls.query.filter(cls.customer_id == customer_id).all()
+        carts = Shopcart.totals_query(Shopcart.updated_at).subquery()
+        abandoned = and_(carts.c.lines > 0, carts.c.updated_at < func.now() - timedelta(seconds=abandoned_after))
+        query = select(
+            func.count().label("count"),
+            func.count().filter(carts.c.lines == 0).label("empty"),
+            func.coalesce(func.avg(carts.c.lines), 0).label("average_lines"),
+            func.coalesce(func.avg(carts.c.units), 0).label("average_units"),
+            func.coalesce(func.avg(carts.c.subtotal), 0).label("average_value"),
+            func.coalesce(func.max(carts.c.subtotal), 0).label("max_value"),
+            func.coalesce(func.sum(carts.c.subtotal), 0).label("total_value"),
+            func.count().filter(abandoned).label("abandoned_count"),
+            func.coalesce(func.sum(carts.c.lines).filter(abandoned), 0).label("abandoned_lines"),
+            func.coalesce(func.sum(carts.c.units).filter(abandoned), 0).label("abandoned_units"),
+            func.coalesce(func.sum(carts.c.subtotal).filter(abandoned), 0).label("abandoned_value"),
+        )
+        row = db.session.execute(query).mappings().one()
+        shopcarts = {"count": row["count"], "empty": row["empty"]}
+        for name in ("average_lines", "average_units", "average_value", "max_value", "total_value"):
+            shopcarts[name] = round(float(row[name]), 2)
+        abandoned = {
+            "after_seconds": abandoned_after,
+            "count": row["abandoned_count"],
+            "lines": int(row["abandoned_lines"]),
+            "units": int(row["abandoned_units"]),
+            "value": round(float(row["abandoned_value"]), 2),
+        }
+        return shopcarts, abandoned
+
+    @staticmethod
+    def popular(attribute, top):
+        """Returns the most common values of an Item attribute with their numbers of lines and units"""
+        query = (
+            select(attribute, func.count().label("lines"), func.sum(Item.quantity))
+            .where(attribute.isnot(None))
+            .group_by(attribute)
+            .order_by(desc("lines"), attribute)
+            .limit(top)
+        )
+        return [
+            {attribute.key: value, "lines": lines, "units": units}
+            for value, lines, units in db.session.execute(query)
+        ]
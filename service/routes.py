@@ -4,10 +4,14 @@ My Service
 Describe what your service does here
 """
 
-from flask import jsonify, request
-from flask_restx import Resource, fields, reqparse
+from flask import Response, jsonify, request, stream_with_context
+from werkzeug.http import quote_etag
+from flask_restx import Model, Resource, fields, inputs, reqparse
 from .common import status  # HTTP Status Codes
-from service.models import Shopcart, Item
+from .common.log_handlers import HOT_PATH
+from .common.pagination import decode_cursor, encode_cursor, link_header
+from .common.serializer import CompiledModel, dumps, json_response
+from service.models import Analytics, Shopcart, Item, cache, db
 
 # Import Flask application
 from . import app, api
@@ -31,6 +35,17 @@ item_model = api.model('Item', {
     'color': fields.String(required=True, description='The color of the item'),
 })
 
+item_batch_result_model = api.model('ItemBatchResult', {
+    'id': fields.Integer(required=True, description='The id of the posted item'),
+    'status': fields.String(required=True, enum=['created', 'updated', 'rejected'],
+                            description='created, updated (quantity merged) or rejected (belongs to another shopcart)'),
+    'item': fields.Nested(item_model, allow_null=True, description='The item as stored in the shopcart'),
+})
+
+item_batch_model = api.model('ItemBatch', {
+    'items': fields.List(fields.Nested(item_batch_result_model), description='One result per posted item'),
+})
+
 # Define the model so that the docs reflect what can be sent
 create_shopcart_model = api.model('Shopcart', {
     'customer_id': fields.Integer(required=True, description='The customer id of the Shopcart'),
@@ -48,9 +63,121 @@ shopcart_model = api.inherit(
     }
 )
 
+totals_model = api.model('ShopcartTotals', {
+    'shopcart_id': fields.Integer(required=True, description='The id of the shopcart'),
+    'lines': fields.Integer(required=True, description='The number of items in the shopcart'),
+    'units': fields.Integer(required=True, description='The sum of the quantities of the items'),
+    'subtotal': fields.Float(required=True, description='The sum of price times quantity of the items'),
+})
+
+shopcart_totals_model = api.inherit(
+    'ShopcartWithTotals',
+    shopcart_model,
+    {
+        'totals': fields.Nested(totals_model, description='With totals=true only'),
+    }
+)
+
+# a shopcart listed with items=false
+shopcart_summary_model = api.model('ShopcartSummary', {
+    'id': fields.Integer(readOnly=True, description='The unique id assigned internally by service'),
+    'customer_id': fields.Integer(required=True, description='The customer id of the Shopcart'),
+    'totals': fields.Nested(totals_model, description='With totals=true only'),
+})
+
+customer_count_model = api.model('CustomerShopcarts', {
+    'customer_id': fields.Integer(required=True, description='The customer id'),
+    'shopcarts': fields.Integer(required=True, description='The number of shopcarts of the customer'),
+})
+
+customer_analytics_model = api.model('CustomerAnalytics', {
+    'count': fields.Integer(required=True, description='The number of customers with shopcarts'),
+    'average_shopcarts': fields.Float(required=True, description='The shopcarts per customer on average'),
+    'max_shopcarts': fields.Integer(required=True, description='The shopcarts of the customer with the most'),
+    'top': fields.List(fields.Nested(customer_count_model), description='The customers with the most shopcarts'),
+})
+
+shopcart_analytics_model = api.model('ShopcartAnalytics', {
+    'count': fields.Integer(required=True, description='The number of shopcarts'),
+    'empty': fields.Integer(required=True, description='The number of shopcarts without items'),
+    'average_lines': fields.Float(required=True, description='The items per shopcart on average'),
+    'average_units': fields.Float(required=True, description='The sum of the quantities per shopcart on average'),
+    'average_value': fields.Float(required=True, description='The subtotal per shopcart on average'),
+    'max_value': fields.Float(required=True, description='The largest subtotal of a shopcart'),
+    'total_value': fields.Float(required=True, description='The sum of the subtotals of the shopcarts'),
+})
+
+abandoned_analytics_model = api.model('AbandonedAnalytics', {
+    'after_seconds': fields.Float(
+        required=True, description='The seconds without a change after which a shopcart is abandoned'
+    ),
+    'count': fields.Integer(required=True, description='The number of abandoned shopcarts, empty ones are not counted'),
+    'lines': fields.Integer(required=True, description='The items in the abandoned shopcarts'),
+    'units': fields.Integer(required=True, description='The sum of the quantities in the abandoned shopcarts'),
+    'value': fields.Float(required=True, description='The sum of the subtotals of the abandoned shopcarts'),
+})
+
+item_name_count_model = api.model('ItemNameCount', {
+    'name': fields.String(required=True, description='The name of the items'),
+    'lines': fields.Integer(required=True, description='The number of items with the name'),
+    'units': fields.Integer(required=True, description='The sum of their quantities'),
+})
+
+item_color_count_model = api.model('ItemColorCount', {
+    'color': fields.String(required=True, description='The color of the items'),
+    'lines': fields.Integer(required=True, description='The number of items with the color'),
+    'units': fields.Integer(required=True, description='The sum of their quantities'),
+})
+
+analytics_model = api.model('Analytics', {
+    'computed_at': fields.String(required=True, description='When the report was computed (ISO 8601, UTC)'),
+    'refresh_interval': fields.Float(required=True, description='The seconds a report is reused'),
+    'customers': fields.Nested(customer_analytics_model),
+    'shopcarts': fields.Nested(shopcart_analytics_model),
+    'abandoned': fields.Nested(abandoned_analytics_model),
+    'item_names': fields.List(fields.Nested(item_name_count_model), description='The most common item names'),
+    'item_colors': fields.List(fields.Nested(item_color_count_model), description='The most common item colors'),
+})
+
+totals_args = reqparse.RequestParser()
+totals_args.add_argument(
+    'totals', type=inputs.boolean, location='args', required=False, default=False,
+    help='Add the totals of the Shopcart, computed by the database'
+)
+
 shopcart_args = reqparse.RequestParser()
 shopcart_args.add_argument('shopcart_id', type=int, location='args', required=False, help='List Shopcarts by shopcart id')
 shopcart_args.add_argument('customer_id', type=int, location='args', required=False, help='List Shopcarts by customer id')
+shopcart_args.add_argument('limit', type=int, location='args', required=False, help='Maximum number of Shopcarts per page')
+shopcart_args.add_argument(
+    'after', type=str, location='args', required=False,
+    help='Cursor from the next link of the previous page'
+)
+shopcart_args.add_argument(
+    'totals', type=inputs.boolean, location='args', required=False, default=False,
+    help='Add the totals of every Shopcart, computed by the database for the whole page at once'
+)
+shopcart_args.add_argument(
+    'items', type=inputs.boolean, location='args', required=False, default=True,
+    help='Include the items of every Shopcart, items=false with totals=true only returns the totals'
+)
+
+# one pass serializers of the models above, see service/common/serializer.py
+serialize_item = CompiledModel(item_model)
+serialize_item_batch = CompiledModel(item_batch_model)
+serialize_shopcart = CompiledModel(shopcart_model)
+# the totals are added to the summaries of a page afterwards, from one query
+serialize_shopcart_summary = CompiledModel(Model('ShopcartSummary', {
+    key: shopcart_summary_model[key] for key in ('id', 'customer_id')
+}))
+serialize_totals = CompiledModel(totals_model)
+serialize_analytics = CompiledModel(analytics_model)
+
+item_update_args = reqparse.RequestParser()
+item_update_args.add_argument(
+    'return', type=str, location='args', required=False, default='shopcart', choices=('shopcart', 'item'),
+    help='Respond with the whole Shopcart (default) or only the updated Item'
+)
 
 
 ######################################################################
@@ -65,7 +192,7 @@ class ShopcartCollection(Resource):
     @api.doc('create_shopcarts')
     @api.response(415, 'The posted data was not valid')
     @api.expect(create_shopcart_model)
-    @api.marshal_with(shopcart_model, code=201)
+    @api.response(201, 'Shopcart created', shopcart_model)
     def post(self):
         """
         Creates a shopcart
@@ -80,45 +207,134 @@ class ShopcartCollection(Resource):
         shopcart.create()
 
         # Create a message to return
-        message = shopcart.serialize()
+        message = serialize_shopcart(shopcart)
         location_url = api.url_for(
             ShopcartResource, shopcart_id=shopcart.id, _external=True)
 
-        return message, status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(message, status.HTTP_201_CREATED, {"Location": location_url})
 
     ######################################################################
     # LIST ALL SHOPCARTS
     ######################################################################
     @api.doc('list_shopcarts')
     @api.expect(shopcart_args, validate=True)
+    @api.response(400, 'The limit or cursor was not valid')
     @api.response(404, 'No shopcart found')
-    @api.marshal_list_with(shopcart_model)
+    @api.response(200, 'Success', [shopcart_totals_model])
     def get(self):
         """
         List all shopcarts.
-        Returns a JSON that contains all shopcarts under the key 'shopcarts'.
+        Returns a JSON list of at most `limit` shopcarts ordered by id.
+        When there are more, a Link header with rel="next" points to the next page.
         """
         shopcarts = []
 
         args = shopcart_args.parse_args()
         arg_shopcart_id = args['shopcart_id']
         arg_customer_id = args['customer_id']
+        limit = app.config["DEFAULT_PAGE_SIZE"] if args['limit'] is None else args['limit']
+        if not 0 < limit <= app.config["MAX_PAGE_SIZE"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"limit must be between 1 and {app.config['MAX_PAGE_SIZE']}."
+            )
+        after_id = decode_cursor(args['after']) if args['after'] else None
+        # fetch one extra shopcart to find out whether there is a next page
+        page = {"after_id": after_id, "limit": limit + 1}
+
+        # the items are loaded after the ETag check, so a 304 costs a single query
+        page["strategy"] = None
 
         if arg_shopcart_id and arg_customer_id:
-            shopcarts = Shopcart.find_by_shopcart_id_and_customer_id(arg_shopcart_id, arg_customer_id)
-            app.logger.info(f"Retrieved shopcarts with specific id: {shopcarts}")
+            shopcarts = Shopcart.find_by_shopcart_id_and_customer_id(arg_shopcart_id, arg_customer_id, **page)
         elif arg_shopcart_id:
-            shopcarts = Shopcart.find_by_shopcart_id(arg_shopcart_id)
-            app.logger.info(f"Retrieved shopcarts with specific id: {shopcarts}")
+            shopcarts = Shopcart.find_by_shopcart_id(arg_shopcart_id, **page)
         elif arg_customer_id:
-            shopcarts = Shopcart.find_by_customer_id(arg_customer_id)
-            app.logger.info(f"Retrieved shopcarts with specific customer_id: {shopcarts}")
+            shopcarts = Shopcart.find_by_customer_id(arg_customer_id, **page)
+        else:
+            shopcarts = Shopcart.all(**page)
+        app.logger.info("Retrieved %d shopcarts", len(shopcarts), extra=HOT_PATH)
+
+        headers = {}
+        has_next = len(shopcarts) > limit
+        if has_next:
+            shopcarts = shopcarts[:limit]
+            query = {key: value for key, value in args.items() if value is not None}
+            query.update(limit=limit, after=encode_cursor(shopcarts[-1].id))
+            next_url = api.url_for(ShopcartCollection, _external=True, **query)
+            headers["Link"] = link_header(next_url)
+
+        etag = Shopcart.list_etag(shopcarts, has_next)
+        headers["ETag"] = quote_etag(etag)
+        if etag in request.if_none_match:
+            return not_modified(headers)
+
+        if args['items']:
+            Shopcart.load_items(shopcarts)
+            results = serialize_shopcart.many(shopcarts)
         else:
-            shopcarts = Shopcart.all()
-            app.logger.info(f"Retrieved shopcarts: {shopcarts}")
+            results = serialize_shopcart_summary.many(shopcarts)
+        if args['totals']:
+            add_totals(results)
+        return json_response(results, status.HTTP_200_OK, headers)
+
+
+######################################################################
+#  PATH: /shopcarts/export
+######################################################################
+@api.route('/shopcarts/export', strict_slashes=False)
+class ShopcartExport(Resource):
+    """ Streams a full dump of the Shopcarts """
+    ######################################################################
+    # EXPORT ALL SHOPCARTS
+    ######################################################################
+    @api.doc('export_shopcarts')
+    @api.produces(['application/x-ndjson'])
+    @api.response(200, 'One JSON Shopcart with its items per line', shopcart_model)
+    def get(self):
+        """
+        Export all shopcarts as newline-delimited JSON.
+        The shopcarts are read from a server-side cursor in batches of EXPORT_BATCH_SIZE
+        and each batch is sent as soon as it is serialized.
+        """
+        batch_size = app.config["EXPORT_BATCH_SIZE"]
+        app.logger.info("Request to export all Shopcarts in batches of %d", batch_size)
 
-        results = [shopcart.serialize() for shopcart in shopcarts]
-        return results, status.HTTP_200_OK
+        def generate():
+            lines = []
+            for shopcart in Shopcart.stream_all(batch_size):
+                lines.append(dumps(serialize_shopcart(shopcart)) + b"\n")
+                if len(lines) == batch_size:
+                    yield b"".join(lines)
+                    lines = []
+            if lines:
+                yield b"".join(lines)
+
+        return Response(stream_with_context(generate()), status.HTTP_200_OK, mimetype="application/x-ndjson")
+
+
+######################################################################
+#  PATH: /analytics
+######################################################################
+@api.route('/analytics', strict_slashes=False)
+class AnalyticsResource(Resource):
+    """ Handles the aggregates of all of the Shopcarts """
+    ######################################################################
+    # READ THE ANALYTICS REPORT
+    ######################################################################
+    @api.doc('get_analytics')
+    @api.response(200, 'Success', analytics_model)
+    def get(self):
+        """
+        Returns the shopcarts per customer, the items and value per shopcart,
+        the most common item names and colors, and the abandoned shopcarts.
+        The report is computed by grouped queries and reused for ANALYTICS_REFRESH_INTERVAL
+        seconds, the Cache-Control header says for how much longer.
+        """
+        app.logger.info("Request for the analytics", extra=HOT_PATH)
+        report, fresh_for = Analytics.report()
+        headers = {"Cache-Control": f"max-age={int(fresh_for)}"}
+        return json_response(serialize_analytics(report), status.HTTP_200_OK, headers)
 
 
 ######################################################################
@@ -139,23 +355,28 @@ class ShopcartResource(Resource):
     # READ A SHOPCART
     ######################################################################
     @api.doc('get_shopcarts')
+    @api.response(304, 'Shopcart not modified since the ETag in If-None-Match')
     @api.response(404, 'Shopcart not found')
-    @api.marshal_with(shopcart_model)
+    @api.response(200, 'Success', shopcart_totals_model)
+    @api.expect(totals_args)
     def get(self, shopcart_id):
         """
         Retrieve a single Shopcart
 
         This endpoint will return a Shopcart based on it's id
         """
-        app.logger.info("Request for Shopcart with id: %s", shopcart_id)
-
-        shopcart = Shopcart.find(shopcart_id)
-        if not shopcart:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Shopcart with id '{shopcart_id}' could not be found.",
-            )
-        return shopcart.serialize(), status.HTTP_200_OK
+        app.logger.info("Request for Shopcart with id: %s", shopcart_id, extra=HOT_PATH)
+
+        etag, shopcart = find_shopcart_if_modified(shopcart_id)
+        headers = {"ETag": quote_etag(etag)}
+        if shopcart is None:
+            return not_modified(headers)
+        if totals_args.parse_args()['totals']:
+            # the cached dictionary is shared, the totals go in a copy
+            shopcart = dict(shopcart)
+            add_totals([shopcart])
+        # the cached dictionary was built by serialize(), it is already in the shape of the model
+        return json_response(shopcart, status.HTTP_200_OK, headers)
 
     ######################################################################
     # DELETE A SHOPCART
@@ -165,16 +386,12 @@ class ShopcartResource(Resource):
     def delete(self, shopcart_id):
         """
         Delete a single Shopcart.
-        This endpoint deletes a shopcart with a specific shopcart ID.
+        This endpoint deletes a shopcart with a specific shopcart ID, its items are deleted with it.
         If no such shopcart exists, return HTTP_204_NO_CONTENT.
         """
         app.logger.info("Deleting Shopcart with id: %d", shopcart_id)
 
-        shopcart = Shopcart.find(shopcart_id)
-        if shopcart:
-            for item in shopcart.items:
-                item.delete()
-            shopcart.delete()
+        Shopcart.delete_by_id(shopcart_id)
 
         return '', status.HTTP_204_NO_CONTENT
 
@@ -184,9 +401,11 @@ class ShopcartResource(Resource):
     @api.doc('update_shopcarts')
     @api.response(404, 'Shopcart not found')
     @api.response(400, 'The posted data was not valid')
+    @api.response(409, 'The shopcart was changed by another request, read it again')
+    @api.response(412, 'The shopcart does not match the ETag in If-Match')
     @api.response(415, 'The posted data was not valid')
     @api.expect(shopcart_model)
-    @api.marshal_with(shopcart_model)
+    @api.response(200, 'Success', shopcart_model)
     def put(self, shopcart_id):
         """
         Update a shopcart with JSON request.
@@ -210,9 +429,46 @@ class ShopcartResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id '{shopcart_id}' could not be found."
             )
+        check_if_match(shopcart)
         shopcart.deserialize(data)
         shopcart.update()
-        return shopcart.serialize(), status.HTTP_200_OK
+        return json_response(serialize_shopcart(shopcart), status.HTTP_200_OK, etag_header(shopcart))
+
+
+######################################################################
+#  PATH: /shopcarts/<shopcart_id>/totals
+######################################################################
+@api.route('/shopcarts/<int:shopcart_id>/totals', strict_slashes=False)
+@api.param('shopcart_id', 'The Shopcart identifier')
+class ShopcartTotals(Resource):
+    """ Handles the totals of a Shopcart """
+    ######################################################################
+    # READ THE TOTALS OF A SHOPCART
+    ######################################################################
+    @api.doc('get_shopcart_totals')
+    @api.response(304, 'Shopcart not modified since the ETag in If-None-Match')
+    @api.response(404, 'Shopcart not found')
+    @api.response(200, 'Success', totals_model)
+    def get(self, shopcart_id):
+        """
+        Retrieve the totals of a Shopcart
+        Returns the number of lines, the number of units and the subtotal of the shopcart,
+        computed by the database without loading the items.
+        """
+        app.logger.info("Request for the totals of Shopcart with id: %s", shopcart_id, extra=HOT_PATH)
+
+        found = Shopcart.find_totals([shopcart_id]).get(shopcart_id)
+        if found is None:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{shopcart_id}' could not be found.",
+            )
+        version, totals = found
+        etag = Shopcart.etag_for(shopcart_id, version)
+        headers = {"ETag": quote_etag(etag)}
+        if etag in request.if_none_match:
+            return not_modified(headers)
+        return json_response(serialize_totals(totals), status.HTTP_200_OK, headers)
 
 
 ######################################################################
@@ -226,6 +482,7 @@ class ItemCollection(Resource):
     # READ ITEMS FROM A SHOPCART
     ######################################################################
     @api.doc('get_items')
+    @api.response(304, 'Items not modified since the ETag in If-None-Match')
     @api.response(404, 'items not found')
     def get(self, shopcart_id):
         """
@@ -233,55 +490,112 @@ class ItemCollection(Resource):
 
         This endpoint will return a Item list based on the Shopcart id
         """
-        app.logger.info("Request for items in Shopcart with id: %s", shopcart_id)
+        app.logger.info("Request for items in Shopcart with id: %s", shopcart_id, extra=HOT_PATH)
 
-        shopcart = Shopcart.find(shopcart_id)
-        if not shopcart:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Shopcart with id '{shopcart_id}' could not be found.",
-            )
-        items = {"items": []}
-        for item in shopcart.items:
-            items["items"].append(item.serialize())
-        return items, status.HTTP_200_OK
+        etag, shopcart = find_shopcart_if_modified(shopcart_id)
+        headers = {"ETag": quote_etag(etag)}
+        if shopcart is None:
+            return not_modified(headers)
+        return json_response({"items": shopcart["items"]}, status.HTTP_200_OK, headers)
 
     ######################################################################
     # ADD AN ITEM TO SHOPCART
     ######################################################################
     @api.doc('create_items')
     @api.response(400, 'The posted data was not valid')
+    @api.response(404, 'Shopcart not found')
+    @api.response(409, 'The item belongs to another shopcart')
+    @api.response(412, 'The shopcart does not match the ETag in If-Match')
     @api.response(415, 'The posted data was not valid')
     @api.expect(item_model)
-    @api.marshal_with(item_model, code=201)
+    @api.response(201, 'Item added', item_model)
     def post(self, shopcart_id):
-        """ Add an item to shopcart """
+        """
+        Add an item to shopcart
+        An item already in the shopcart has its quantity increased by a single atomic statement.
+        """
         app.logger.info(
             "Request to add an item to shopcart with id: %s", shopcart_id)
         check_content_type("application/json")
-        shopcart = Shopcart.find(shopcart_id)
-        if not shopcart:
+        data = api.payload
+        item = Item()
+        item.deserialize(dict(data, shopcart_id=shopcart_id) if isinstance(data, dict) else data)
+        versions = if_match_versions(shopcart_id)
+        added = Item.add_to_shopcart(shopcart_id, [item], versions)
+        if added[item.id] is None:
+            # nothing was written, find out why on this rare path only
+            version = find_shopcart_version(shopcart_id)
+            if versions is not None and version not in versions:
+                abort(
+                    status.HTTP_412_PRECONDITION_FAILED,
+                    f"Shopcart with id '{shopcart_id}' was changed, its version is now {version}."
+                )
             abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Shopcart with id '{shopcart_id}' could not be found.",
+                status.HTTP_409_CONFLICT,
+                f"Item with id '{item.id}' belongs to another shopcart.",
             )
-        # temp_item is the data in request
-        temp_item = api.payload
-        item = Item.find(temp_item["id"])
-        if item:
-            item.quantity += temp_item["quantity"]
-        else:
-            item = Item()
-            temp_item["shopcart_id"] = shopcart_id
-            item.deserialize(temp_item)
-            shopcart.items.append(item)
-        shopcart.update()
-        message = item.serialize()
+        stored_item, _ = added[item.id]
         location_url = api.url_for(
-            ShopcartResource, shopcart_id=shopcart.id, _external=True)
+            ShopcartResource, shopcart_id=shopcart_id, _external=True)
         app.logger.info(
             "Item with ID [%s] has been added to the shopcart with ID [%s]", item.id, shopcart_id)
-        return message, status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(serialize_item(stored_item), status.HTTP_201_CREATED, {"Location": location_url})
+
+
+######################################################################
+#  PATH: /shopcarts/<shopcart_id>/items/batch
+######################################################################
+@api.route('/shopcarts/<int:shopcart_id>/items/batch', strict_slashes=False)
+@api.param('shopcart_id', 'The shopcart identifier')
+class ItemBatch(Resource):
+    """ Handles adding many items to a Shopcart at once """
+    ######################################################################
+    # ADD A LIST OF ITEMS TO SHOPCART
+    ######################################################################
+    @api.doc('create_items_batch')
+    @api.response(400, 'The posted data was not valid')
+    @api.response(404, 'Shopcart not found')
+    @api.response(415, 'The posted data was not valid')
+    @api.expect([item_model])
+    @api.response(200, 'Success', item_batch_model)
+    def post(self, shopcart_id):
+        """
+        Add a list of items to a shopcart
+        Items already in the shopcart have their quantity increased, like the single item endpoint.
+        All of the items are written in one transaction with a single multi-row statement.
+        """
+        app.logger.info("Request to add a batch of items to shopcart with id: %s", shopcart_id)
+        check_content_type("application/json")
+        payload = api.payload
+        if not isinstance(payload, list) or not payload:
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be a non-empty list of items.")
+        items = []
+        for data in payload:
+            item = Item()
+            item.deserialize(dict(data, shopcart_id=shopcart_id) if isinstance(data, dict) else data)
+            items.append(item)
+
+        shopcart = Shopcart.find(shopcart_id, strategy=None)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{shopcart_id}' could not be found.",
+            )
+        added = Item.add_to_shopcart(shopcart_id, items)
+
+        results = []
+        for item in items:
+            if added[item.id] is None:
+                results.append({"id": item.id, "status": "rejected", "item": None})
+            else:
+                stored_item, created = added[item.id]
+                results.append({
+                    "id": item.id,
+                    "status": "created" if created else "updated",
+                    "item": stored_item,
+                })
+        app.logger.info("Added a batch of %d items to the shopcart with ID [%s]", len(items), shopcart_id)
+        return json_response(serialize_item_batch({"items": results}), status.HTTP_200_OK)
 
 
 ######################################################################
@@ -304,28 +618,20 @@ class ItemResource(Resource):
     ######################################################################
     @api.doc('get_items')
     @api.response(404, 'Item not found')
-    @api.marshal_with(item_model)
+    @api.response(200, 'Success', item_model)
     def get(self, shopcart_id, item_id):
         """
         Read an item from a shopcart.
         Returns JSON of the item if it exists and the shopcart exists.
         Returns a 404 Error if either of the item or the shopcart does not exist.
         """
-        app.logger.info("Reading Item %d from Shopcart %d", item_id, shopcart_id)
-
-        shopcart = Shopcart.find(shopcart_id)
-        if not shopcart:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Shopcart with id '{shopcart_id}' could not be found."
-            )
+        app.logger.info("Reading Item %d from Shopcart %d", item_id, shopcart_id, extra=HOT_PATH)
 
-        app.logger.info("item_id: %d, shopcart id: %d", item_id, shopcart_id)
-        for item in shopcart.items:
-            if item.id == item_id:
-                return item.serialize(), status.HTTP_200_OK
-
-        return "Item not found", status.HTTP_404_NOT_FOUND
+        item = Item.find_in_shopcart(shopcart_id, item_id)
+        if not item:
+            find_shopcart_version(shopcart_id)
+            abort(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' could not be found.")
+        return json_response(serialize_item(item), status.HTTP_200_OK)
 
     ######################################################################
     # DELETE AN ITEM FROM SHOPCART
@@ -350,18 +656,22 @@ class ItemResource(Resource):
     # UPDATE AN ITEM IN SHOPCART
     ######################################################################
     @api.doc('update_items')
+    @api.response(200, 'Success', shopcart_model)
     @api.response(404, 'Shopcart not found')
     @api.response(400, 'The posted Item data was not valid')
+    @api.response(409, 'The shopcart was changed by another request, read it again')
+    @api.response(412, 'The shopcart does not match the ETag in If-Match')
     @api.response(415, 'The posted data was not valid')
-    @api.expect(item_model)
-    @api.marshal_with(shopcart_model)
+    @api.expect(item_update_args, item_model)
     def put(self, shopcart_id, item_id):
         """
         Update an item{item_id} in a certain shopcart{shopcart_id}.
         This endpoint will update an item based on the shopcart_id and item_id argument in the url
+        Responds with the whole shopcart, or with only the item when called with ?return=item
         """
         app.logger.info("Request to update an item")
         check_content_type("application/json")
+        args = item_update_args.parse_args()
 
         req = api.payload
         if not "quantity" in req.keys() and not "price" in req.keys() and not "color" in req.keys():
@@ -387,35 +697,33 @@ class ItemResource(Resource):
             else:
                 color = req["color"]
 
-        # Make sure the shopcart exists
-        shopcart = Shopcart.find(shopcart_id)
+        # Make sure the shopcart exists, its items are not loaded
+        shopcart = Shopcart.find(shopcart_id, strategy=None)
         if not shopcart:
             abort(status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id {shopcart_id} was not found.")
-        item_index = -1
+        check_if_match(shopcart)
         # Make sure the item exists
-        for i, item in enumerate(shopcart.items):
-            if item.id == item_id:
-                item_index = i
-                # Now proceed to update
-                if quantity:
-                    item.quantity = quantity
-                    app.logger.info(
-                        f"item {item_id}'s quantity is changed to {quantity}")
-                if price is not None and price >= 0:
-                    item.price = price
-                    app.logger.info(
-                        f"item {item_id}'s price is changed to {price}")
-                if color:
-                    item.color = color
-                    app.logger.info(
-                        f"item {item_id}'s color is changed to {color}")
-                shopcart.update()
-                return shopcart.serialize(), status.HTTP_200_OK
-
-        if item_index == -1:
+        item = Item.find_in_shopcart(shopcart_id, item_id)
+        if not item:
             abort(status.HTTP_404_NOT_FOUND, f"item with id {item_id} was not found.")
 
+        # Now proceed to update
+        if quantity:
+            item.quantity = quantity
+            app.logger.info("item %s's quantity is changed to %s", item_id, quantity)
+        if price is not None and price >= 0:
+            item.price = price
+            app.logger.info("item %s's price is changed to %s", item_id, price)
+        if color:
+            item.color = color
+            app.logger.info("item %s's color is changed to %s", item_id, color)
+        # bumps the version of the shopcart, which fails if another request changed it
+        shopcart.update()
+        if args["return"] == "item":
+            return json_response(serialize_item(item), status.HTTP_200_OK, etag_header(shopcart))
+        return json_response(serialize_shopcart(shopcart), status.HTTP_200_OK, etag_header(shopcart))
+
 ######################################################################
 # Health Endpoint for Kubernetes
 ######################################################################
@@ -424,19 +732,40 @@ def check_health():
     """ The health endpoint for Kubernetes """
     return jsonify(status="OK"), status.HTTP_200_OK
 
+
+######################################################################
+# Connection pool statistics of this worker
+######################################################################
+@app.route("/stats/pool", methods=["GET"])
+def pool_stats():
+    """ Returns the usage and wait statistics of the database connection pool """
+    pool = db.engine.pool
+    if not hasattr(pool, "stats"):
+        return jsonify(pool=pool.status()), status.HTTP_200_OK
+    return jsonify(pool.stats()), status.HTTP_200_OK
+
+
+######################################################################
+# Shopcart cache statistics of this worker
+######################################################################
+@app.route("/stats/cache", methods=["GET"])
+def cache_stats():
+    """ Returns the hit, miss and eviction counters of the shopcart cache """
+    return jsonify(cache.stats()), status.HTTP_200_OK
+
 ######################################################################
 #  PATH: /shopcarts/<shopcart_id>/reset
 ######################################################################
 @api.route('/shopcarts/<int:shopcart_id>/reset', strict_slashes=False)
 @api.param('shopcart_id', 'The Shopcart identifier')
 class ShopcartReset(Resource):
-    ##########å############################################################
+    ######################################################################
     # RESET A SHOPCART
     ######################################################################
     @api.doc('reset_shopcarts')
     @api.response(404, 'Shopcart not found')
     @api.expect(shopcart_model)
-    @api.marshal_with(shopcart_model)
+    @api.response(200, 'Success', shopcart_model)
     def put(self, shopcart_id):
         """
         Reset a shopcart.
@@ -445,15 +774,14 @@ class ShopcartReset(Resource):
         """
         app.logger.info("Resetting Shopcart with id: %d", shopcart_id)
 
-        shopcart = Shopcart.find(shopcart_id)
+        shopcart = Shopcart.find(shopcart_id, strategy=None)
         if not shopcart:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id '{shopcart_id}' could not be found."
             )
-        shopcart.items.clear()
-        shopcart.update()
-        return shopcart.serialize(), status.HTTP_200_OK
+        shopcart.clear_items()
+        return json_response(serialize_shopcart(shopcart), status.HTTP_200_OK)
 
 ######################################################################
 #  PATH: /shopcarts/<shopcart_id>/checkout
@@ -465,8 +793,10 @@ class ShopcartCheckout(Resource):
     # CHECKOUT ITEMS FROM A SHOPCART
     ######################################################################
     @api.doc('checkout_items')
+    @api.response(400, 'The posted data was not valid')
     @api.response(404, 'shopcart or item could not be found')
     @api.response(403, 'item does not belong to this shopcart')
+    @api.response(409, 'item was removed from the shopcart during the checkout')
     @api.expect(shopcart_model)
     def post(self, shopcart_id):
         """
@@ -474,32 +804,43 @@ class ShopcartCheckout(Resource):
         Returns JSON of a list of selected items; remove these items from shopcart.
         Returns a 404 Error if any item is not in the item list of the shopcart.
         Returns a 404 Error if the shopcart does not exist.
+        The items are either all checked out in one transaction or none of them is.
         """
         app.logger.info("Checking out items from Shopcart %d", shopcart_id)
 
-        shopcart = Shopcart.find(shopcart_id)
+        # only checking that the shopcart exists, so leave the items lazy
+        shopcart = Shopcart.find(shopcart_id, strategy=None)
         if not shopcart:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id '{shopcart_id}' could not be found."
             )
-        
-        items_to_checkout = api.payload["items"]
-        for item in items_to_checkout:
-            item_looked_up = Item.find(item["id"])
-            if not item_looked_up:
+
+        try:
+            item_ids = [item["id"] for item in api.payload["items"]]
+        except (KeyError, TypeError):
+            abort(status.HTTP_400_BAD_REQUEST, "Checkout must contain a list of items with an id.")
+
+        # check the ownership of every item with one query before deleting any of them
+        owners = Item.find_shopcart_ids(item_ids)
+        for item_id in item_ids:
+            if item_id not in owners:
                 abort(
                     status.HTTP_404_NOT_FOUND,
-                    f"item with id {item['id']} could not be found."
+                    f"item with id {item_id} could not be found."
                 )
-            elif item_looked_up.shopcart_id != shopcart_id:
+            elif owners[item_id] != shopcart_id:
                 abort(
                     status.HTTP_403_FORBIDDEN,
-                    f"item with id {item['id']} does not belong to shopcart"
+                    f"item with id {item_id} does not belong to shopcart"
                     + f" with id {shopcart_id}."
                 )
-            else:
-                item_looked_up.delete()
+
+        if Item.checkout(shopcart_id, item_ids) is None:
+            abort(
+                status.HTTP_409_CONFLICT,
+                f"items were removed from shopcart with id {shopcart_id} during the checkout."
+            )
 
         return api.payload, status.HTTP_200_OK
 
@@ -507,10 +848,85 @@ class ShopcartCheckout(Resource):
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
-def init_db():
-    """ Initializes the SQLAlchemy app """
-    global app
-    Shopcart.init_db(app)
+def init_app():
+    """ Initializes the SQLAlchemy app, the database is connected on first use """
+    Shopcart.init_app(app)
+
+
+def find_shopcart_if_modified(shopcart_id):
+    """Returns the ETag and the serialized Shopcart unless the client already has it
+
+    Only the version of the Shopcart is looked up first: the serialized Shopcart
+    is None when the If-None-Match header holds the current ETag, and a missing
+    Shopcart aborts with 404, in both cases without loading the items.
+    """
+    version = Shopcart.find_version(shopcart_id)
+    if version is None:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Shopcart with id '{shopcart_id}' could not be found.",
+        )
+    etag = Shopcart.etag_for(shopcart_id, version)
+    if etag in request.if_none_match:
+        return etag, None
+    version, shopcart = Shopcart.find_serialized(shopcart_id, version)
+    return Shopcart.etag_for(shopcart_id, version), shopcart
+
+
+def add_totals(shopcarts):
+    """Adds the totals to serialized Shopcarts with one aggregate query"""
+    found = Shopcart.find_totals([shopcart["id"] for shopcart in shopcarts])
+    for shopcart in shopcarts:
+        # a Shopcart deleted since it was read has no totals
+        shopcart["totals"] = found[shopcart["id"]][1] if shopcart["id"] in found else None
+
+
+def find_shopcart_version(shopcart_id):
+    """Returns the version of a Shopcart, aborts with 404 if it does not exist"""
+    version = Shopcart.find_version(shopcart_id)
+    if version is None:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Shopcart with id '{shopcart_id}' could not be found."
+        )
+    return version
+
+
+def check_if_match(shopcart):
+    """Aborts with 412 unless the If-Match header, when sent, holds the current ETag of the Shopcart"""
+    if request.if_match and Shopcart.etag_for(shopcart.id, shopcart.version) not in request.if_match:
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"Shopcart with id '{shopcart.id}' was changed, its version is now {shopcart.version}."
+        )
+
+
+def if_match_versions(shopcart_id):
+    """Returns the Shopcart versions allowed by the If-Match header, None when any version is
+
+    Aborts with 412 if the header only holds ETags of other Shopcarts
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = [Shopcart.version_from_etag(shopcart_id, etag) for etag in request.if_match.as_set()]
+    versions = [version for version in versions if version is not None]
+    if not versions:
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"If-Match does not hold an ETag of the shopcart with id '{shopcart_id}'."
+        )
+    return versions
+
+
+def etag_header(shopcart):
+    """Returns the ETag header of the current version of a Shopcart"""
+    return {"ETag": quote_etag(Shopcart.etag_for(shopcart.id, shopcart.version))}
+
+
+def not_modified(headers):
+    """Returns a 304 Not Modified response, which has no body"""
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
 
 def check_content_type(media_type):
     """Checks that the media type is correct"""
@@ -2,6 +2,13 @@ import factory
 from factory.fuzzy import FuzzyChoice
 from service.models import Shopcart, Item
 
+# values of the fake items and shopcarts, also used by benchmarks/seed.py
+ITEM_NAMES = ["laptop", "monitor", "desk", "mouse", "pc"]
+ITEM_QUANTITIES = [2, 3, 5, 8, 1]
+ITEM_PRICES = [10, 15.46, 17.51, 199999.2, 663, 2183]
+ITEM_COLORS = ["red", "yellow", "green"]
+CUSTOMER_IDS = [1, 5, 15, 20, 35, 68]
+
 class ItemFactory(factory.Factory):
     """ Creates fake items  """
 
@@ -9,10 +16,10 @@ class ItemFactory(factory.Factory):
         model = Item
 
     id = factory.Sequence(lambda n: n)
-    name = FuzzyChoice(choices=["laptop", "monitor", "desk", "mouse","pc"])
-    quantity = FuzzyChoice(choices=[2,3,5,8,1])
-    price = FuzzyChoice(choices=[10,15.46,17.51,199999.2,663,2183])
-    color = FuzzyChoice(choices=["red", "yellow", "green"])
+    name = FuzzyChoice(choices=ITEM_NAMES)
+    quantity = FuzzyChoice(choices=ITEM_QUANTITIES)
+    price = FuzzyChoice(choices=ITEM_PRICES)
+    color = FuzzyChoice(choices=ITEM_COLORS)
 
 class ShopcartFactory(factory.Factory):
     """ Creates fake Shopcarts """
@@ -20,4 +27,4 @@ class ShopcartFactory(factory.Factory):
     class Meta:
         model = Shopcart
 
-    customer_id = FuzzyChoice(choices=[1, 5, 15, 20, 35, 68])
\ No newline at end of file
+    customer_id = FuzzyChoice(choices=CUSTOMER_IDS)
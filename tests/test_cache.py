@@ -0,0 +1,84 @@
+"""
+Test cases for the cache backends
+
+"""
+import unittest
+from unittest.mock import patch
+from flask import Flask
+from service.common.cache import Cache, CacheBackend, LocalCache, NullCache
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestLocalCache(unittest.TestCase):
+    """ Test Cases for LocalCache """
+
+    def test_get_and_set(self):
+        """It should return stored values and count hits and misses"""
+        cache = LocalCache(max_size=10, ttl=60)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", {"id": 1})
+        self.assertEqual(cache.get("a"), {"id": 1})
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_delete_and_clear(self):
+        """It should remove values"""
+        cache = LocalCache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+        cache.delete("missing")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+        cache.clear()
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used value beyond the size cap"""
+        cache = LocalCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expire_after_ttl(self):
+        """It should not return values older than the time to live"""
+        cache = LocalCache(max_size=2, ttl=5)
+        with patch("service.common.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1)
+        with patch("service.common.cache.time.monotonic", return_value=104.0):
+            self.assertEqual(cache.get("a"), 1)
+        with patch("service.common.cache.time.monotonic", return_value=105.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+
+class TestCache(unittest.TestCase):
+    """ Test Cases for the Cache proxy """
+
+    def test_init_app(self):
+        """It should create the backend from the app configuration"""
+        app = Flask(__name__)
+        cache = Cache()
+        self.assertIsInstance(cache.backend, NullCache)
+        app.config.update(CACHE_BACKEND="local", CACHE_MAX_SIZE=5, CACHE_TTL=1.5)
+        cache.init_app(app)
+        self.assertIsInstance(cache.backend, LocalCache)
+        self.assertEqual((cache.stats()["max_size"], cache.stats()["ttl"]), (5, 1.5))
+        app.config["CACHE_BACKEND"] = "null"
+        cache.init_app(app)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["misses"], 1)
+        app.config["CACHE_BACKEND"] = "memcached"
+        self.assertRaises(ValueError, cache.init_app, app)
+
+    def test_backend_interface(self):
+        """It should require backends to implement the interface"""
+        self.assertRaises(TypeError, CacheBackend)
@@ -0,0 +1,93 @@
+"""
+Test cases for the gunicorn configuration
+
+"""
+import os
+import tempfile
+import unittest
+from importlib.util import module_from_spec, spec_from_file_location
+from unittest.mock import patch
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_config(**environ):
+    """Executes gunicorn.conf.py with the given environment variables"""
+    spec = spec_from_file_location("gunicorn_conf", CONFIG_FILE)
+    config = module_from_spec(spec)
+    with patch.dict(os.environ, environ):
+        spec.loader.exec_module(config)
+    return config
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G   T E S T   C A S E S
+######################################################################
+class TestGunicornConfig(unittest.TestCase):
+    """ Test Cases for gunicorn.conf.py """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.cgroup = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        """ This runs after each test """
+        self.cgroup.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.cgroup.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+
+    def test_workers_sized_from_the_deployment_limits(self):
+        """It should run a single worker within 0.2 CPU and 64Mi"""
+        config = load_config(CPU_LIMIT_MILLICORES="200", MEMORY_LIMIT_MB="64", GUNICORN_WORKERS="")
+        self.assertEqual(config.workers, 1)
+        self.assertEqual(config.worker_class, "sync")
+        self.assertTrue(config.preload_app)
+        config = load_config(CPU_LIMIT_MILLICORES="2000", MEMORY_LIMIT_MB="1024", GUNICORN_WORKERS="")
+        self.assertEqual(config.workers, 5)
+        config = load_config(GUNICORN_WORKERS="3")
+        self.assertEqual(config.workers, 3)
+
+    def test_worker_classes(self):
+        """It should configure the gthread and gevent workers"""
+        config = load_config(GUNICORN_WORKER_CLASS="gthread", GUNICORN_THREADS="8")
+        self.assertEqual(config.threads, 8)
+        config = load_config(GUNICORN_WORKER_CLASS="gevent")
+        self.assertFalse(config.preload_app)
+        self.assertRaises(ValueError, load_config, GUNICORN_WORKER_CLASS="eventlet")
+
+    def test_limits_from_cgroup_v2(self):
+        """It should read the CPU and memory limits of a cgroup v2"""
+        config = load_config()
+        self._write("cpu.max", "20000 100000\n")
+        self._write("memory.max", f"{64 * 2 ** 20}\n")
+        with patch.dict(os.environ, {"CPU_LIMIT_MILLICORES": "", "MEMORY_LIMIT_MB": ""}):
+            self.assertEqual(config.cpu_limit(self.cgroup.name), 0.2)
+            self.assertEqual(config.memory_limit_mb(self.cgroup.name), 64)
+            self._write("memory.max", "max\n")
+            self.assertIsNone(config.memory_limit_mb(self.cgroup.name))
+
+    def test_limits_from_cgroup_v1(self):
+        """It should read the CPU and memory limits of a cgroup v1"""
+        config = load_config()
+        self._write("cpu/cpu.cfs_quota_us", "50000\n")
+        self._write("cpu/cpu.cfs_period_us", "100000\n")
+        self._write("memory/memory.limit_in_bytes", "9223372036854771712\n")
+        with patch.dict(os.environ, {"CPU_LIMIT_MILLICORES": "", "MEMORY_LIMIT_MB": ""}):
+            self.assertEqual(config.cpu_limit(self.cgroup.name), 0.5)
+            self.assertIsNone(config.memory_limit_mb(self.cgroup.name))
+
+    def test_metrics_of_the_workers(self):
+        """It should reset the metrics directory on start and drop the gauges of dead workers"""
+        metrics_dir = os.path.join(self.cgroup.name, "metrics")
+        config = load_config(PROMETHEUS_MULTIPROC_DIR=metrics_dir)
+        self._write("metrics/counter_1.db", "stale")
+        with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": metrics_dir}):
+            config.on_starting(None)
+            self.assertEqual(os.listdir(metrics_dir), [])
+            self._write("metrics/gauge_livesum_42.db", "")
+            config.child_exit(None, type("Worker", (), {"pid": 42}))
+            self.assertEqual(os.listdir(metrics_dir), [])
@@ -0,0 +1,103 @@
+"""
+Test cases for the log handlers
+
+"""
+import io
+import json
+import logging
+import unittest
+from unittest.mock import patch
+from flask import Flask
+from service import app as service_app
+from service.common import log_handlers
+from service.common.log_handlers import HOT_PATH, init_logging
+
+
+class Unprintable:
+    """An argument that counts how many times it was formatted"""
+    calls = 0
+
+    def __repr__(self):
+        Unprintable.calls += 1
+        return "unprintable"
+
+
+######################################################################
+#  L O G   H A N D L E R S   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(unittest.TestCase):
+    """ Test Cases for init_logging """
+
+    @classmethod
+    def tearDownClass(cls):
+        """ This runs once after the entire test suite """
+        init_logging(service_app, "gunicorn.error")
+
+    def setUp(self):
+        """ This runs before each test """
+        self.output = io.StringIO()
+        self.target = logging.getLogger("tests.gunicorn")
+        self.target.handlers = [logging.StreamHandler(self.output)]
+        self.target.setLevel(logging.INFO)
+        self.app = Flask("tests")
+
+    def _lines(self):
+        """Stops the listener and returns the JSON lines it wrote"""
+        log_handlers.stop_listener()
+        return [json.loads(line) for line in self.output.getvalue().splitlines()]
+
+    def test_json_lines(self):
+        """It should write the records as JSON with their extra fields and exceptions"""
+        init_logging(self.app, "tests.gunicorn")
+        self.app.logger.info("Added %d items", 3, extra={"shopcart_id": 7})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.app.logger.exception("Failed")
+        lines = self._lines()
+        self.assertEqual(lines[0]["message"], "Logging handler established")
+        self.assertEqual(lines[1]["message"], "Added 3 items")
+        self.assertEqual((lines[1]["level"], lines[1]["logger"], lines[1]["shopcart_id"]), ("INFO", "tests", 7))
+        self.assertIn("ValueError: boom", lines[2]["exception"])
+
+    def test_text_format(self):
+        """It should keep the text format when LOG_FORMAT is text"""
+        self.app.config["LOG_FORMAT"] = "text"
+        init_logging(self.app, "tests.gunicorn")
+        log_handlers.stop_listener()
+        self.assertIn("[INFO] [log_handlers] Logging handler established", self.output.getvalue())
+
+    def test_sample_hot_path(self):
+        """It should keep a sample of the hot path messages and all of the others"""
+        self.app.config["LOG_SAMPLE_RATE"] = 0.5
+        init_logging(self.app, "tests.gunicorn")
+        with patch("service.common.log_handlers.random.random", side_effect=[0.7, 0.2]):
+            self.app.logger.info("dropped", extra=HOT_PATH)
+            self.app.logger.info("kept", extra=HOT_PATH)
+            self.app.logger.info("always")
+        lines = self._lines()
+        self.assertEqual([line["message"] for line in lines[1:]], ["kept", "always"])
+        self.assertEqual(lines[1]["sample_rate"], 0.5)
+        self.assertNotIn("sampled", lines[1])
+
+    def test_lazy_formatting(self):
+        """It should not format the arguments of filtered messages"""
+        init_logging(self.app, "tests.gunicorn")
+        Unprintable.calls = 0
+        self.app.logger.debug("Retrieved %s", Unprintable())
+        self.assertEqual(Unprintable.calls, 0)
+        self.app.logger.info("Retrieved %s", Unprintable())
+        self.assertEqual(Unprintable.calls, 1)
+        self.assertEqual(self._lines()[1]["message"], "Retrieved unprintable")
+
+    def test_restart_after_fork(self):
+        """It should write the records of a forked process from a new queue"""
+        init_logging(self.app, "tests.gunicorn")
+        # pylint: disable=protected-access
+        parent, queue = log_handlers._listener, self.app.logger.handlers[0].queue
+        log_handlers._restart_listener()
+        parent.stop()  # the thread of the parent is gone in a real fork
+        self.assertIsNot(self.app.logger.handlers[0].queue, queue)
+        self.app.logger.info("in the child")
+        lines = self._lines()
+        self.assertEqual(lines[-1]["message"], "in the child")
@@ -6,14 +6,16 @@ Test cases can be run with the following:
   coverage report -m
 """
 from cgitb import scanvars
+import json
 import os
 import logging
 from random import randint, sample
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
+from sqlalchemy.orm.exc import StaleDataError
 from tests.factories import ShopcartFactory, ItemFactory
 from service.routes import app
-from service.models import Shopcart, db
+from service.models import Analytics, Shopcart, cache, db
 from service.common import status  # HTTP Status Codes
 
 DATABASE_URI = os.getenv(
@@ -47,6 +49,7 @@ class TestShopcartServer(TestCase):
         """ This runs before each test """
         db.drop_all()
         db.create_all()
+        cache.clear()
         self.client = app.test_client()
 
     def tearDown(self):
@@ -97,6 +100,44 @@ class TestShopcartServer(TestCase):
         resp = self.client.get("/")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
 
+    def test_pool_stats(self):
+        """It should return the statistics of the connection pool"""
+        self.client.get(BASE_URL)
+        resp = self.client.get("/stats/pool")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        for key in ("size", "checked_out", "overflow", "checkouts", "wait_seconds_avg", "wait_seconds_max"):
+            self.assertIn(key, data)
+        self.assertGreater(data["checkouts"], 0)
+
+    def test_read_shopcart_through_cache(self):
+        """It should serve repeated reads from the cache and invalidate it on writes"""
+        shopcart = self._create_shopcarts(1)[0]
+        item = self._create_items(1)[0]
+        before = cache.stats()
+        self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        stats = cache.stats()
+        self.assertEqual(stats["misses"] - before["misses"], 1)
+        self.assertEqual(stats["hits"] - before["hits"], 1)
+
+        # adding an item invalidates the cached shopcart
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize(), content_type="application/json")
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual([data["id"] for data in resp.get_json()["items"]], [item.id])
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{item.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        # and so does deleting it
+        self.client.delete(f"{BASE_URL}/{shopcart.id}/items/{item.id}")
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.get_json()["items"], [])
+
+        resp = self.client.get("/stats/cache")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for key in ("hits", "misses", "evictions", "expirations", "size"):
+            self.assertIn(key, resp.get_json())
+
     def test_create_shopcart(self):
         """It should Create a new Shopcart"""
         shopcart = ShopcartFactory()
@@ -174,12 +215,17 @@ class TestShopcartServer(TestCase):
     def test_delete_shopcart(self):
         """It should Delete a shopcart with a specific ID"""
         shopcart = self._create_shopcarts(1)[0]
+        item = self._create_items(1)[0]
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
         resp = self.client.delete(
             f"{BASE_URL}/{shopcart.id}"
         )
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        # its items are deleted with it
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{item.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
         # delete a non-existing shopcart
-        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
         resp = self.client.delete(
             f"{BASE_URL}/{shopcart.id}"
         )
@@ -195,6 +241,70 @@ class TestShopcartServer(TestCase):
 
         self.assertEqual(resp_dict, shopcarts)
 
+    def test_list_shopcarts_in_pages(self):
+        """It should List shopcarts one page at a time following the next links"""
+        shopcarts = [sc.serialize() for sc in self._create_shopcarts(5)]
+        resp = self.client.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), shopcarts[:2])
+
+        pages = [resp.get_json()]
+        while "Link" in resp.headers:
+            self.assertTrue(resp.headers["Link"].endswith('>; rel="next"'))
+            next_url = resp.headers["Link"][1:resp.headers["Link"].index(">")]
+            self.assertIn("limit=2", next_url)
+            resp = self.client.get(next_url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            pages.append(resp.get_json())
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([sc for page in pages for sc in page], shopcarts)
+
+    def test_list_shopcarts_by_customer_id_in_pages(self):
+        """It should keep the customer_id filter in the next links"""
+        for _ in range(3):
+            self.client.post(BASE_URL, json={"customer_id": 7, "items": []})
+            self.client.post(BASE_URL, json={"customer_id": 8, "items": []})
+        resp = self.client.get(BASE_URL, query_string="customer_id=7&limit=2")
+        self.assertEqual(len(resp.get_json()), 2)
+        next_url = resp.headers["Link"][1:resp.headers["Link"].index(">")]
+        self.assertIn("customer_id=7", next_url)
+        resp = self.client.get(next_url)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["customer_id"], 7)
+        self.assertNotIn("Link", resp.headers)
+
+    def test_list_shopcarts_with_bad_page(self):
+        """It should not List shopcarts with a bad limit or cursor"""
+        resp = self.client.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="limit=100000")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="after=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_shopcarts(self):
+        """It should Export all shopcarts and their items as newline-delimited JSON"""
+        for _ in range(5):
+            shopcart = ShopcartFactory()
+            shopcart.items = self._create_items(2)
+            shopcart.create()
+        expected = [sc.serialize() for sc in Shopcart.all()]
+
+        with patch.dict(app.config, {"EXPORT_BATCH_SIZE": 2}):
+            resp = self.client.get(f"{BASE_URL}/export")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertTrue(resp.is_streamed)
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_export_no_shopcarts(self):
+        """It should Export an empty body when there are no shopcarts"""
+        resp = self.client.get(f"{BASE_URL}/export")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_data(), b"")
+
     def test_reset_shopcart(self):
         """It should reset a shopcart (clear all items)."""
         shopcart = self._create_shopcarts(1)[0]
@@ -212,6 +322,16 @@ class TestShopcartServer(TestCase):
         cleared_shopcart.items.clear()
         self.assertEqual(resp_dict, cleared_shopcart.serialize())
 
+        # the items stored in the shopcart are deleted, and no longer served from the cache
+        items = self._create_items(3)
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items/batch", json=[item.serialize() for item in items])
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(len(resp.get_json()["items"]), 3)
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}/reset")
+        self.assertEqual(resp.get_json()["items"], [])
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(resp.get_json()["items"], [])
+
         # check if the function behaves given that the shopcart does not exist
         shopcart_id = shopcart.id
         resp = self.client.delete(
@@ -273,6 +393,134 @@ class TestShopcartServer(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
 
+        # adding it again increases the quantity in the shopcart
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json()["quantity"], item.quantity * 2)
+
+    def test_add_an_item_without_id(self):
+        """It should add an item posted with a null id under the next id of the sequence"""
+        shopcart = self._create_shopcarts(1)[0]
+        first = ItemFactory(id=None)
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=first.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        first_id = resp.get_json()["id"]
+        self.assertIsNotNone(first_id)
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory(id=None).serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(resp.get_json()["id"], first_id)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{first_id}")
+        self.assertEqual(resp.get_json()["name"], first.name)
+
+    def test_add_an_item_without_id_after_explicit_ids(self):
+        """It should not merge an item posted without an id into an item posted with an explicit id"""
+        shopcart = self._create_shopcarts(1)[0]
+        laptop = ItemFactory(id=1, name="laptop", quantity=1)
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=laptop.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        mouse = ItemFactory(id=None, name="mouse", quantity=3)
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=mouse.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(resp.get_json()["id"], 1)
+        items = self.client.get(f"{BASE_URL}/{shopcart.id}/items").get_json()["items"]
+        self.assertEqual(sorted((item["name"], item["quantity"]) for item in items), [("laptop", 1), ("mouse", 3)])
+
+    def test_add_an_item_of_another_shopcart(self):
+        """It should not add an item that belongs to another shopcart"""
+        shopcart, other_shopcart = self._create_shopcarts(2)
+        item = self._create_items(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        etag = self.client.get(f"{BASE_URL}/{other_shopcart.id}").headers["ETag"]
+        resp = self.client.post(f"{BASE_URL}/{other_shopcart.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        # the rejected item does not change the other shopcart
+        self.assertEqual(self.client.get(f"{BASE_URL}/{other_shopcart.id}").headers["ETag"], etag)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{item.id}")
+        self.assertEqual(resp.get_json()["quantity"], item.quantity)
+
+        resp = self.client.post(f"{BASE_URL}/0/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json={"id": item.id})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_add_a_batch_of_items_to_shopcart(self):
+        """It should add a list of items to a shopcart in one request"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = self._create_items(3)
+        payload = [item.serialize() for item in items]
+        # the same item twice in the batch is merged like two single adds
+        payload.append(dict(payload[0], quantity=4))
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/items/batch", json=payload, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()["items"]
+        self.assertEqual([result["id"] for result in results], [item["id"] for item in payload])
+        self.assertTrue(all(result["status"] == "created" for result in results))
+        self.assertEqual(results[0]["item"]["quantity"], items[0].quantity + 4)
+        self.assertEqual(results[1]["item"]["shopcart_id"], shopcart.id)
+
+        # posting again merges the quantities into the existing items
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/items/batch", json=payload[1:3], content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()["items"]
+        self.assertEqual([result["status"] for result in results], ["updated", "updated"])
+        self.assertEqual(results[0]["item"]["quantity"], 2 * items[1].quantity)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(len(resp.get_json()["items"]), 3)
+
+        # items that belong to another shopcart are rejected
+        other_shopcart = self._create_shopcarts(1)[0]
+        new_item = self._create_items(1)[0]
+        resp = self.client.post(
+            f"{BASE_URL}/{other_shopcart.id}/items/batch",
+            json=[payload[0], new_item.serialize()],
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()["items"]
+        self.assertEqual(results[0], {"id": payload[0]["id"], "status": "rejected", "item": None})
+        self.assertEqual(results[1]["status"], "created")
+
+    def test_add_a_batch_of_items_without_ids(self):
+        """It should give each item of a batch posted without an id its own id"""
+        shopcart = self._create_shopcarts(1)[0]
+        payload = [ItemFactory(id=None, quantity=quantity).serialize() for quantity in (1, 2, 3)]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items/batch", json=payload)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()["items"]
+        self.assertEqual([result["status"] for result in results], ["created"] * 3)
+        self.assertEqual(len({result["id"] for result in results}), 3)
+        self.assertEqual([result["item"]["quantity"] for result in results], [1, 2, 3])
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(len(resp.get_json()["items"]), 3)
+
+        for bad_id in ("1", 1.5, True):
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items/batch", json=[dict(payload[0], id=bad_id)])
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_add_a_batch_of_items_with_bad_data(self):
+        """It should not add a batch of items with bad data"""
+        shopcart = self._create_shopcarts(1)[0]
+        item = self._create_items(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/items/batch"
+        resp = self.client.post(url, json=[item.serialize()], content_type="text/html")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        resp = self.client.post(url, json=item.serialize(), content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(url, json=[], content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(url, json=[{"name": "no id"}], content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id + 1}/items/batch", json=[item.serialize()], content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_read_item(self):
         """ It should return a JSON of the specified item."""
         # Create a fictional shopcart and POST it
@@ -395,6 +643,35 @@ class TestShopcartServer(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
         
+    def test_update_item_returning_only_the_item(self):
+        """It should update an item of a large shopcart and return only that item"""
+        shopcart, other_shopcart = self._create_shopcarts(2)
+        items = self._create_items(20)
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/items/batch", json=[item.serialize() for item in items]
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        item = items[7]
+
+        resp = self.client.put(
+            f"{BASE_URL}/{shopcart.id}/items/{item.id}", query_string={"return": "item"}, json={"quantity": 9}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), dict(item.serialize(), shopcart_id=shopcart.id, quantity=9))
+        self.assertEqual(resp.headers["ETag"], f'"{shopcart.id}-3"')
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{item.id}")
+        self.assertEqual(resp.get_json()["quantity"], 9)
+
+        resp = self.client.put(
+            f"{BASE_URL}/{shopcart.id}/items/{item.id}", query_string={"return": "all"}, json={"quantity": 9}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        # the item is not found through another shopcart
+        resp = self.client.get(f"{BASE_URL}/{other_shopcart.id}/items/{item.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.put(f"{BASE_URL}/{other_shopcart.id}/items/{item.id}", json={"quantity": 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_query_shopcarts_by_shopcart_id_and_customer_id(self):
         """It should List all shopcarts with query shopcart_id_and_customer_id"""
         shopcarts = self._create_shopcarts(5)
@@ -490,3 +767,186 @@ class TestShopcartServer(TestCase):
             content_type="application/json"
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_checkout_is_all_or_nothing(self):
+        """It should not checkout any item when one of them belongs to another shopcart"""
+        shopcart, other_shopcart = self._create_shopcarts(2)
+        items = self._create_items(3)
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items/batch",
+                         json=[item.serialize() for item in items[:2]], content_type="application/json")
+        self.client.post(f"{BASE_URL}/{other_shopcart.id}/items",
+                         json=items[2].serialize(), content_type="application/json")
+
+        checkout_dict = {"items": [item.serialize() for item in items]}
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/checkout", json=checkout_dict)
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(len(resp.get_json()["items"]), 2)
+
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/checkout", json={"items": [{"name": "no id"}]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_shopcart_if_none_match(self):
+        """It should answer 304 to a conditional GET of an unchanged shopcart"""
+        shopcart = self._create_shopcarts(1)[0]
+        item = self._create_items(1)[0]
+        for url in (f"{BASE_URL}/{shopcart.id}", f"{BASE_URL}/{shopcart.id}/items"):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            etag = resp.headers["ETag"]
+            self.assertEqual(etag, f'"{shopcart.id}-1"')
+
+            resp = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(resp.headers["ETag"], etag)
+            self.assertEqual(resp.get_data(), b"")
+
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize(), content_type="application/json")
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], f'"{shopcart.id}-2"')
+        self.assertEqual(len(resp.get_json()["items"]), 1)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id + 1}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_shopcarts_if_none_match(self):
+        """It should answer 304 to a conditional GET of an unchanged page of shopcarts"""
+        shopcarts = self._create_shopcarts(3)
+        resp = self.client.get(BASE_URL)
+        etag = resp.headers["ETag"]
+        resp = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.get_data(), b"")
+
+        # the ETag depends on the page
+        resp = self.client.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        item = self._create_items(1)[0]
+        self.client.post(f"{BASE_URL}/{shopcarts[1].id}/items", json=item.serialize(), content_type="application/json")
+        resp = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 3)
+        self.assertEqual(len(resp.get_json()[1]["items"]), 1)
+
+    def test_update_shopcart_if_match(self):
+        """It should only update a shopcart that still matches the ETag in If-Match"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+
+        data["customer_id"] = 4242
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        new_etag = resp.headers["ETag"]
+        self.assertNotEqual(new_etag, etag)
+
+        # a writer holding the old version is refused
+        data["customer_id"] = 4343
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        item = self._create_items(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize(), headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize(), headers={"If-Match": '"0-2"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize(), headers={"If-Match": new_etag})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.put(
+            f"{BASE_URL}/{shopcart.id}/items/{item.id}", json={"quantity": 3}, headers={"If-Match": new_etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        resp = self.client.put(
+            f"{BASE_URL}/{shopcart.id}/items/{item.id}", json={"quantity": 3}, headers={"If-Match": resp.headers["ETag"]}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], f'"{shopcart.id}-4"')
+        self.assertEqual(resp.get_json()["customer_id"], 4242)
+
+    def test_concurrent_update_conflict(self):
+        """It should answer 409 when another request changed the shopcart during an update"""
+        shopcart = self._create_shopcarts(1)[0]
+        data = self.client.get(f"{BASE_URL}/{shopcart.id}").get_json()
+        with patch("service.models.Shopcart.update", side_effect=StaleDataError("version changed")):
+            resp = self.client.put(f"{BASE_URL}/{shopcart.id}", json=data)
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+            resp = self.client.put(f"{BASE_URL}/{shopcart.id}", json=data, headers={"If-Match": "*"})
+            self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_swagger_documents_the_responses(self):
+        """It should keep the response models in the Swagger docs"""
+        resp = self.client.get("/api/swagger.json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        paths = resp.get_json()["paths"]
+        responses = paths["/shopcarts/{shopcart_id}"]["get"]["responses"]
+        self.assertEqual(responses["200"]["schema"]["$ref"], "#/definitions/ShopcartWithTotals")
+        responses = paths["/shopcarts"]["get"]["responses"]
+        self.assertEqual(responses["200"]["schema"]["items"]["$ref"], "#/definitions/ShopcartWithTotals")
+        responses = paths["/shopcarts/{shopcart_id}/items"]["post"]["responses"]
+        self.assertEqual(responses["201"]["schema"]["$ref"], "#/definitions/Item")
+
+    def test_shopcart_totals(self):
+        """It should return the totals of a shopcart computed by the database"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/totals")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"shopcart_id": shopcart.id, "lines": 0, "units": 0, "subtotal": 0.0})
+        for price, quantity in ((1.25, 2), (10.0, 3)):
+            item = ItemFactory(price=price, quantity=quantity)
+            self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/totals")
+        self.assertEqual(resp.get_json(), {"shopcart_id": shopcart.id, "lines": 2, "units": 5, "subtotal": 32.5})
+        self.assertEqual(resp.headers["ETag"], self.client.get(f"{BASE_URL}/{shopcart.id}").headers["ETag"])
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/totals", headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.client.get(f"{BASE_URL}/0/totals")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}", query_string={"totals": "true"})
+        data = resp.get_json()
+        self.assertEqual(len(data["items"]), 2)
+        self.assertEqual(data["totals"]["subtotal"], 32.5)
+        self.assertNotIn("totals", self.client.get(f"{BASE_URL}/{shopcart.id}").get_json())
+
+    def test_list_shopcarts_with_totals(self):
+        """It should add the totals to a page of shopcarts, with or without their items"""
+        shopcarts = self._create_shopcarts(3)
+        item = ItemFactory(price=2.0, quantity=4)
+        self.client.post(f"{BASE_URL}/{shopcarts[0].id}/items", json=item.serialize())
+        resp = self.client.get(BASE_URL, query_string={"totals": "true"})
+        data = resp.get_json()
+        self.assertEqual([shopcart["totals"]["subtotal"] for shopcart in data], [8.0, 0.0, 0.0])
+        self.assertEqual(len(data[0]["items"]), 1)
+        resp = self.client.get(BASE_URL, query_string={"totals": "true", "items": "false"})
+        data = resp.get_json()
+        self.assertEqual(set(data[0]), {"id", "customer_id", "totals"})
+        self.assertEqual(data[0]["totals"]["units"], 4)
+        resp = self.client.get(BASE_URL)
+        self.assertNotIn("totals", resp.get_json()[0])
+
+    def test_analytics(self):
+        """It should return the analytics report and reuse it for the refresh interval"""
+        Analytics.clear()
+        shopcarts = self._create_shopcarts(2)
+        item = ItemFactory(name="desk", color="red", price=3.0, quantity=2)
+        self.client.post(f"{BASE_URL}/{shopcarts[0].id}/items", json=item.serialize())
+        resp = self.client.get("/api/analytics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertRegex(resp.headers["Cache-Control"], r"^max-age=(59|60)$")
+        data = resp.get_json()
+        self.assertEqual(data["shopcarts"]["count"], 2)
+        self.assertEqual(data["shopcarts"]["total_value"], 6.0)
+        self.assertEqual(data["customers"]["count"], len({shopcart.customer_id for shopcart in shopcarts}))
+        self.assertEqual(data["item_names"], [{"name": "desk", "lines": 1, "units": 2}])
+        self.assertEqual(data["item_colors"], [{"color": "red", "lines": 1, "units": 2}])
+        self.assertEqual(data["abandoned"]["count"], 0)
+        # a new shopcart only shows up once the report is refreshed
+        self._create_shopcarts(1)
+        self.assertEqual(self.client.get("/api/analytics").get_json(), data)
+        Analytics.clear()
+        self.assertEqual(self.client.get("/api/analytics").get_json()["shopcarts"]["count"], 3)
@@ -0,0 +1,70 @@
+"""
+Test cases for the compiled serializers
+
+"""
+import json
+import unittest
+from unittest.mock import patch
+from flask_restx import Model, fields, marshal
+from service.common import serializer
+from service.common.serializer import CompiledModel, dumps, json_response
+from service.models import Item, Shopcart
+from service.routes import item_batch_model, item_model, shopcart_model
+
+
+######################################################################
+#  S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestCompiledModel(unittest.TestCase):
+    """ Test Cases for CompiledModel """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.items = [
+            Item(id=1, shopcart_id=7, name="pen", price=1.5, quantity=2, color="red"),
+            Item(id=2, shopcart_id=7, name="ink", price=3.0, quantity=1, color=None),
+        ]
+        self.shopcart = Shopcart(id=7, customer_id=42, items=self.items)
+
+    def test_same_as_marshal(self):
+        """It should produce what marshal() produces from objects and dictionaries"""
+        serialize = CompiledModel(shopcart_model)
+        expected = marshal(self.shopcart.serialize(), shopcart_model)
+        self.assertEqual(serialize(self.shopcart), expected)
+        self.assertEqual(serialize(self.shopcart.serialize()), expected)
+        self.assertEqual(list(serialize(self.shopcart)), list(expected))
+        self.assertEqual(CompiledModel(item_model).many(self.items), [item.serialize() for item in self.items])
+
+    def test_nested_and_null(self):
+        """It should serialize nested models and keep null ones"""
+        results = {"items": [
+            {"id": 1, "status": "created", "item": self.items[0]},
+            {"id": 3, "status": "rejected", "item": None},
+        ]}
+        document = CompiledModel(item_batch_model)(results)
+        self.assertEqual(document["items"][0]["item"], self.items[0].serialize())
+        self.assertIsNone(document["items"][1]["item"])
+
+    def test_single_field_model(self):
+        """It should serialize a model of a single field"""
+        model = Model("ItemId", {"id": fields.Integer()})
+        self.assertEqual(CompiledModel(model)(self.items[0]), {"id": 1})
+
+
+class TestEncoding(unittest.TestCase):
+    """ Test Cases for dumps and json_response """
+
+    def test_dumps(self):
+        """It should encode compact JSON with or without orjson"""
+        data = {"id": 1, "items": [{"price": 1.5, "color": None}]}
+        self.assertEqual(json.loads(dumps(data)), data)
+        with patch.object(serializer, "orjson", None):
+            self.assertEqual(dumps(data), b'{"id":1,"items":[{"price":1.5,"color":null}]}')
+
+    def test_json_response(self):
+        """It should return a JSON response with the status and headers"""
+        resp = json_response({"id": 1}, 201, {"Location": "/api/shopcarts/1"})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(resp.headers["Location"], "/api/shopcarts/1")
+        self.assertEqual(json.loads(resp.get_data()), {"id": 1})